@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Group-by and pivot over columns of values, behind okta-scripts.py aggregate.
+
+Data is held as columns (a dict of name -> list of values, all the same
+length) rather than as one dict per row. Grouping and counting then run
+inside C builtins (map, dict.fromkeys, Counter, itertools.compress)
+instead of an interpreted loop per row: each row's group is looked up
+once and replaced by a small integer code that every measure then counts
+by. This pays off for data that is already in columns (the user cache,
+snapshots); for a one-off pass over row dicts a plain loop is as quick.
+python benchmark.py --aggregate 1000000 times it.
+
+    columns = read_columns(rows, ["Department", "Okta Status"])
+    group_by(columns, ["Department"], {"Total": count(), "Active": count_where("Okta Status", "ACTIVE")})
+    pivot_table(columns, ["Department"], ["Okta Status"], {"Users": count()})
+
+Measures:
+    count()                     rows in the group
+    count_where(column, value)  rows whose column equals value
+    count_unless(column, value) rows whose column does not equal value
+    total(column)               sum of a numeric column (blank counts as 0)
+    distinct(column)            number of different values of a column
+"""
+import collections
+import operator
+from itertools import compress, repeat
+
+
+class Measure:
+    """How to reduce one group's rows to a number."""
+
+    def __init__(self, name, column=None, value=None):
+        self.name = name
+        self.column = column
+        self.value = value
+
+    def __repr__(self):
+        return f"{self.name}({self.column!r}, {self.value!r})" if self.column else f"{self.name}()"
+
+    def compute(self, keys, columns):
+        """Value of the measure for every group code in keys, as a dict (missing codes mean 0)."""
+        if self.name == 'count':
+            return collections.Counter(keys)
+        values = columns[self.column]
+        if self.name == 'count_where':
+            return collections.Counter(compress(keys, map(operator.eq, values, repeat(self.value))))
+        if self.name == 'count_unless':
+            return collections.Counter(compress(keys, map(operator.ne, values, repeat(self.value))))
+        if self.name == 'distinct':
+            return collections.Counter(key for key, _ in dict.fromkeys(zip(keys, values)))
+        totals = collections.defaultdict(int)
+        for key, value in zip(keys, values):
+            if value not in (None, ''):
+                totals[key] += number(value)
+        return totals
+
+
+def count():
+    return Measure('count')
+
+
+def count_where(column, value):
+    return Measure('count_where', column, value)
+
+
+def count_unless(column, value):
+    return Measure('count_unless', column, value)
+
+
+def total(column):
+    return Measure('total', column)
+
+
+def distinct(column):
+    return Measure('distinct', column)
+
+
+def number(value):
+    """int or float from a CSV cell or JSON value."""
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def parse_measure(spec):
+    """Measure from a command line spec: count, COLUMN=VALUE, COLUMN!=VALUE, sum:COLUMN or distinct:COLUMN."""
+    if spec == 'count':
+        return count()
+    if spec.startswith('sum:'):
+        return total(spec[len('sum:'):])
+    if spec.startswith('distinct:'):
+        return distinct(spec[len('distinct:'):])
+    if '!=' in spec:
+        column, value = spec.split('!=', 1)
+        return count_unless(column, value)
+    if '=' in spec:
+        column, value = spec.split('=', 1)
+        return count_where(column, value)
+    raise ValueError(f"Unknown measure {spec!r}; use count, COLUMN=VALUE, COLUMN!=VALUE, sum:COLUMN or distinct:COLUMN")
+
+
+def read_columns(rows, names, missing=''):
+    """Turn an iterable of dict rows into columns holding only names."""
+    rows = rows if isinstance(rows, list) else list(rows)
+    return {name: [row.get(name, missing) for row in rows] for name in names}
+
+
+def factorise(values):
+    """The distinct values in order of appearance, and each value's index into them."""
+    index = dict.fromkeys(values)
+    for code, value in enumerate(index):
+        index[value] = code
+    return list(index), list(map(index.__getitem__, values))
+
+
+def group_codes(columns, dimensions):
+    """The distinct tuples of dimension values in order of appearance, and each row's index into them.
+
+    Each dimension is factorised on its own, where hashing is cheap because
+    strings cache their hash, and the codes are combined into one integer
+    per row instead of hashing a tuple per row. With no dimensions every
+    row falls in one group.
+    """
+    if not dimensions:
+        rows = len(next(iter(columns.values()), []))
+        return ([()] if rows else []), [0] * rows
+    if len(dimensions) == 1:
+        values, codes = factorise(columns[dimensions[0]])
+        return [(value,) for value in values], codes
+    distinct_values = []
+    combined = None
+    for dimension in dimensions:
+        values, codes = factorise(columns[dimension])
+        distinct_values.append(values)
+        if combined is None:
+            combined = codes
+        else:
+            combined = list(map(operator.add, map(operator.mul, combined, repeat(len(values))), codes))
+    keys, codes = factorise(combined)
+    groups = []
+    for key in keys:
+        group = []
+        for values in reversed(distinct_values):
+            key, code = divmod(key, len(values))
+            group.append(values[code])
+        groups.append(tuple(reversed(group)))
+    return groups, codes
+
+
+def group_by(columns, dimensions, measures):
+    """Aggregate columns by dimensions into one dict row per group.
+
+    Each row holds the group's dimension values followed by one value per
+    measure, keyed by the names in measures. Groups come out in the order
+    they first appear in the data.
+    """
+    groups, codes = group_codes(columns, dimensions)
+    results = {name: measure.compute(codes, columns) for name, measure in measures.items()}
+    rows = []
+    for code, group in enumerate(groups):
+        row = dict(zip(dimensions, group))
+        for name, result in results.items():
+            row[name] = result.get(code, 0)
+        rows.append(row)
+    return rows
+
+
+def pivot_table(columns, dimensions, pivot_columns, measures):
+    """group_by, with every combination of pivot_columns' values spread into its own column.
+
+    Column headers are the pivot values joined with " / ", followed by the
+    measure name when there is more than one measure. Combinations a group
+    does not have are 0.
+    """
+    cells, codes = group_codes(columns, dimensions + pivot_columns)
+    results = {name: measure.compute(codes, columns) for name, measure in measures.items()}
+    split = len(dimensions)
+    # Result code of each (group, pivot values) pair that occurs
+    cell_codes = {cell: code for code, cell in enumerate(cells)}
+    groups = dict.fromkeys(cell[:split] for cell in cells)
+    spread = dict.fromkeys(cell[split:] for cell in cells)
+
+    def header(values, name):
+        label = " / ".join(str(value) for value in values)
+        return f"{label} {name}" if len(measures) > 1 else label
+
+    rows = []
+    for group in groups:
+        row = dict(zip(dimensions, group))
+        for values in spread:
+            code = cell_codes.get(group + values)
+            for name, result in results.items():
+                row[header(values, name)] = result.get(code, 0)
+        rows.append(row)
+    return rows
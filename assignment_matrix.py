@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Compact user x app assignment matrix for the app assignment report.
+
+A dict per user with an empty string for every app costs one string slot
+per cell before a single assignment is known; 60k users and 500 apps is
+30M of them. Here each user is one tuple of its report columns and each
+app column is a bitset with one bit per user, so the same matrix fits in
+under 4 MB. Rows are only expanded into strings while they are written.
+
+Writers: the wide CSV the report has always produced, a sparse long
+format CSV with one line per assignment, and Parquet (needs pyarrow).
+"""
+import csv
+import importlib
+
+
+ASSIGNED = "assigned"
+# Rows converted per Parquet record batch
+PARQUET_BATCH_SIZE = 10000
+
+
+class AssignmentMatrix:
+    """Users as rows, app labels as columns, one bit per assignment."""
+
+    def __init__(self, user_columns, app_labels):
+        self.user_columns = list(user_columns)
+        # Apps sharing a label share a column, as they always have in the CSV
+        self.app_labels = list(dict.fromkeys(app_labels))
+        self.app_index = {label: index for index, label in enumerate(self.app_labels)}
+        self.user_ids = []
+        self.user_values = []
+        self.user_index = {}
+        self.bits = [bytearray() for _ in self.app_labels]
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def add_user(self, user_id, values):
+        """Add a row; values are the user's report columns in user_columns order."""
+        row = len(self.user_ids)
+        self.user_index[user_id] = row
+        self.user_ids.append(user_id)
+        self.user_values.append(tuple(values))
+        if row % 8 == 0:
+            # Every eighth user starts a new byte in each column
+            for column in self.bits:
+                column.append(0)
+
+    def mark(self, app_label, user_ids):
+        """Mark users as assigned to an app; ids outside the report are ignored."""
+        column = self.bits[self.app_index[app_label]]
+        for user_id in user_ids:
+            row = self.user_index.get(user_id)
+            if row is not None:
+                column[row >> 3] |= 1 << (row & 7)
+
+    def mark_user(self, user_id, app_labels):
+        """Mark one user as assigned to each of app_labels."""
+        row = self.user_index.get(user_id)
+        if row is None:
+            return
+        for label in app_labels:
+            self.bits[self.app_index[label]][row >> 3] |= 1 << (row & 7)
+
+    def is_assigned(self, row, app):
+        return bool(self.bits[app][row >> 3] & (1 << (row & 7)))
+
+    def assigned_apps(self, row):
+        """Column indexes of the apps assigned to a row."""
+        byte, bit = row >> 3, 1 << (row & 7)
+        return [app for app, column in enumerate(self.bits) if column[byte] & bit]
+
+    def iter_rows(self):
+        """Yield each user's wide report row as a list, one at a time."""
+        empty = [""] * len(self.app_labels)
+        for row, values in enumerate(self.user_values):
+            cells = list(empty)
+            for app in self.assigned_apps(row):
+                cells[app] = ASSIGNED
+            yield list(values) + cells
+
+    def iter_assignments(self):
+        """Yield (user id, user values, app label) for every assignment."""
+        for row, values in enumerate(self.user_values):
+            for app in self.assigned_apps(row):
+                yield self.user_ids[row], values, self.app_labels[app]
+
+
+def write_wide_csv(matrix, path):
+    """One row per user and one column per app, streamed from the matrix."""
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(matrix.user_columns + matrix.app_labels)
+        writer.writerows(matrix.iter_rows())
+
+
+def write_long_csv(matrix, path):
+    """One row per (user, app) assignment; unassigned pairs are not written."""
+    with open(path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["User Id"] + matrix.user_columns + ["Application"])
+        for user_id, values, app_label in matrix.iter_assignments():
+            writer.writerow([user_id, *values, app_label])
+
+
+def optional_text(value):
+    """Parquet string cell: None stays missing, anything else becomes a string."""
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+def load_pyarrow(purpose="Parquet output", module='pyarrow.parquet'):
+    """Import pyarrow and module on first use; it is slow to import and only Arrow and Parquet files need it."""
+    try:
+        import pyarrow
+        importlib.import_module(module)
+    except ImportError:
+        raise ImportError(f"{purpose} needs pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def write_parquet(matrix, path):
+    """Wide table with a boolean column per app, written in record batches."""
+    pyarrow = load_pyarrow()
+    # Parquet column names must be unique; app labels could repeat a user column
+    names = ["User Id"] + matrix.user_columns + [f"app:{label}" for label in matrix.app_labels]
+    schema = pyarrow.schema(
+        [(name, pyarrow.string()) for name in names[:len(matrix.user_columns) + 1]]
+        + [(name, pyarrow.bool_()) for name in names[len(matrix.user_columns) + 1:]]
+    )
+    with pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+        for start in range(0, len(matrix), PARQUET_BATCH_SIZE):
+            rows = range(start, min(start + PARQUET_BATCH_SIZE, len(matrix)))
+            columns = [[matrix.user_ids[row] for row in rows]]
+            columns += [[optional_text(matrix.user_values[row][i]) for row in rows]
+                        for i in range(len(matrix.user_columns))]
+            columns += [[matrix.is_assigned(row, app) for row in rows] for app in range(len(matrix.app_labels))]
+            writer.write_batch(pyarrow.record_batch(columns, schema=schema))
+
+
+WRITERS = {
+    'csv': ('.csv', write_wide_csv),
+    'long': ('-long.csv', write_long_csv),
+    'parquet': ('.parquet', write_parquet),
+}
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""Time the report scripts end to end against fake_okta at several org sizes.
+
+Every report runs in its own process against a freshly generated org, so
+the numbers include startup, the user sync and writing the output. For
+each run the wall time, API requests (and 429s), requests per second,
+bytes served and the process's peak RSS are printed and appended as a
+JSON line to the results file. Pass --compare with an earlier results
+file to see how each number moved.
+
+    python benchmark.py --sizes 1000,10000 --reports fastpass,app-report
+
+Rate limits use Okta's per-minute defaults over a --window of 1 second
+by default, so runs are paced like a real org but 60 times faster.
+
+--churn gives that fraction of users a new FastPass device before each
+report, so a daily incremental run can be timed after a full one:
+
+    python benchmark.py --sizes 10000 --reports fastpass,fastpass --cache warm --churn 0.01
+
+--aggregate times aggregate.group_by on columns of that many generated
+users instead, next to a plain loop over the same rows as dicts:
+
+    python benchmark.py --aggregate 1000000
+
+--in-process calls each report's okta-scripts entry point in this process
+instead, with a fresh client per run and the state earlier runs left
+behind cleared, to time the crawl alone without interpreter startup
+(peak RSS is not measured then).
+"""
+import argparse
+import csv
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from fake_okta import FakeOkta, SyntheticOrg
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_RESULTS_PATH = "benchmark-results.jsonl"
+
+
+def write_enrich_input(org, path):
+    """Rows as exported from another system: mostly emails, some names only, some unknown."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['First', 'Last', 'Email'])
+        for i, user in enumerate(org.users[::2]):
+            profile = user['profile']
+            if i % 10 == 0:
+                writer.writerow([profile['firstName'], profile['lastName'], ''])
+            elif i % 10 == 1:
+                writer.writerow(['Unknown', f"Person{i}", f"unknown{i}@elsewhere.com"])
+            else:
+                writer.writerow([profile['firstName'], profile['lastName'], profile['email']])
+
+
+# Script, the answers its prompts expect (formatted with the run directory) and its output file
+REPORTS = {
+    'enrich': ('enrich_userdata_okta.py', "{run}/input.csv\nenriched\n", "Documents/enriched.csv"),
+    'pivot': ('okta-department-pivot.py', "{run}/pivot-input.csv\ndepartments\ndept-\n",
+              "Documents/departments_pivot.csv"),
+    'fastpass': ('fastpass_report.py', "fastpass\n", "Documents/fastpass.csv"),
+    'app-report': ('okta-app-assignment-report.py', "", "Documents/Applications_report.csv"),
+}
+
+
+# okta-scripts command line per report, formatted with the run directory, for --in-process
+CLI_ARGUMENTS = {
+    'enrich': "enrich --input {run}/input.csv --output {run}/Documents/enriched.csv",
+    'pivot': "pivot --input {run}/pivot-input.csv --output {run}/Documents/departments_pivot.csv --prefix dept-",
+    'fastpass': "fastpass --output {run}/Documents/fastpass.csv",
+    'app-report': "app-report --output {run}/Documents/Applications_report",
+}
+
+
+def load_cli():
+    """The okta-scripts module; importing it has no side effects."""
+    spec = importlib.util.spec_from_file_location('okta_scripts', os.path.join(HERE, "okta-scripts.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def reset_process_state(cli):
+    """Forget what earlier in-process runs left behind, so each run syncs and loads its scripts afresh.
+
+    Without this the user caches synced by one run would be handed to the
+    next one, which then skips the sync it is meant to time.
+    """
+    import user_cache
+    for cache in user_cache.SYNCED_CACHES.values():
+        cache.close()
+    user_cache.SYNCED_CACHES.clear()
+    for script in cli.SCRIPTS.values():
+        sys.modules.pop(os.path.splitext(script)[0].replace('-', '_'), None)
+
+
+def run_in_process(name, fake, run_dir, env):
+    """Run one report through its okta-scripts entry point in this process and return its measurements."""
+    cli = load_cli()
+    reset_process_state(cli)
+    args = cli.build_parser().parse_args(CLI_ARGUMENTS[name].format(run=run_dir).split())
+    args.workers = cli.DEFAULT_WORKERS
+    saved = dict(os.environ)
+    os.environ.update(env)
+    fake.reset_counters()
+    started = time.perf_counter()
+    try:
+        with cli.create_client(fake.url, 'benchmark', workers=args.workers) as client:
+            ok = args.run(client, args)
+    except Exception as e:
+        print(f"{name} failed: {e}")
+        ok = False
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+    elapsed = time.perf_counter() - started
+    requests_made = fake.total_requests()
+    return {
+        'report': name,
+        'ok': bool(ok),
+        'seconds': round(elapsed, 3),
+        'requests': requests_made,
+        'throttled': fake.throttled,
+        'requests_per_second': round(requests_made / elapsed, 1) if elapsed else None,
+        'bytes': fake.bytes_sent,
+        'peak_rss_mb': None,
+        'by_endpoint': dict(fake.counts),
+    }
+
+
+def run_report(name, fake, run_dir, env):
+    """Run one report in a child process and return its measurements."""
+    script, answers, output = REPORTS[name]
+    fake.reset_counters()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, script)], cwd=run_dir, env=env,
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    process.stdin.write(answers.format(run=run_dir))
+    process.stdin.close()
+    errors = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - started
+    output_path = os.path.join(run_dir, output)
+    ok = process.returncode == 0 and os.path.exists(output_path)
+    if not ok:
+        print(f"{name} failed (exit {process.returncode}): {errors.strip()[-500:]}")
+    requests_made = fake.total_requests()
+    return {
+        'report': name,
+        'ok': ok,
+        'seconds': round(elapsed, 3),
+        'requests': requests_made,
+        'throttled': fake.throttled,
+        'requests_per_second': round(requests_made / elapsed, 1) if elapsed else None,
+        'bytes': fake.bytes_sent,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'by_endpoint': dict(fake.counts),
+    }
+
+
+def run_size(users, args):
+    """Benchmark every selected report against one generated org."""
+    org = SyntheticOrg(users=users, apps=args.apps, groups=args.groups, seed=args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as run_dir, FakeOkta(org, latency=args.latency, window=args.window) as fake:
+        os.makedirs(os.path.join(run_dir, "Documents"))
+        write_enrich_input(org, os.path.join(run_dir, "input.csv"))
+        env = {
+            **os.environ,
+            'HOME': run_dir,
+            'OKTA_ORG_URL': fake.url,
+            'OKTA_API_KEY': 'benchmark',
+            'OKTA_CHECKPOINT_DIR': os.path.join(run_dir, "checkpoints"),
+        }
+        rng = random.Random(args.seed)
+        runner = run_in_process if args.in_process else run_report
+        for run, name in enumerate(args.reports):
+            if args.cache == 'off':
+                env['OKTA_USER_CACHE'] = env['OKTA_FACTOR_CACHE'] = 'off'
+            elif args.cache == 'cold':
+                env['OKTA_USER_CACHE'] = os.path.join(run_dir, f"users-{run}.sqlite3")
+                env['OKTA_FACTOR_CACHE'] = os.path.join(run_dir, f"factors-{run}.sqlite3")
+            else:
+                env['OKTA_USER_CACHE'] = os.path.join(run_dir, "users.sqlite3")
+                env['OKTA_FACTOR_CACHE'] = os.path.join(run_dir, "factors.sqlite3")
+            for user in rng.sample(org.users, int(len(org.users) * args.churn)):
+                org.enroll_fastpass(user['id'])
+            if name == 'pivot':
+                # The pivot reads what enrich writes; build it from enrich when that ran first
+                enriched = os.path.join(run_dir, REPORTS['enrich'][2])
+                if not os.path.exists(enriched):
+                    runner('enrich', fake, run_dir, env)
+                os.replace(enriched, os.path.join(run_dir, "pivot-input.csv"))
+            result = runner(name, fake, run_dir, env)
+            result.update({'in_process': args.in_process, 'users': users, 'apps': args.apps, 'backend': env.get('OKTA_BACKEND', 'sync'),
+                           'cache': args.cache, 'churn': args.churn, 'time': time.time()})
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def benchmark_aggregate(rows, seed):
+    """Time group_by over columns against one loop over the same rows as dicts, and print both."""
+    import aggregate
+    org = SyntheticOrg(users=min(rows, 10000), apps=1, groups=1, seed=seed)
+    users = [org.users[i % len(org.users)] for i in range(rows)]
+    columns = {
+        'status': [user['status'] for user in users],
+        'profile.department': [user['profile']['department'] for user in users],
+        'profile.userType': [user['profile']['userType'] for user in users],
+        'profile.title': [f"Title {i % 50}" for i in range(rows)],
+    }
+    measures = {'users': aggregate.count(), 'active': aggregate.count_where('status', 'ACTIVE'),
+                'inactive': aggregate.count_unless('status', 'ACTIVE')}
+    dicts = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def loop(dimensions):
+        groups = {}
+        for row in dicts:
+            key = tuple(row[dimension] for dimension in dimensions)
+            counts = groups.get(key)
+            if counts is None:
+                counts = groups[key] = {'users': 0, 'active': 0, 'inactive': 0}
+            counts['users'] += 1
+            counts['active' if row['status'] == 'ACTIVE' else 'inactive'] += 1
+        return groups
+
+    for dimensions in (['profile.department'], ['profile.department', 'profile.userType', 'profile.title']):
+        timings = []
+        for run in (lambda: aggregate.group_by(columns, dimensions, measures), lambda: loop(dimensions)):
+            started = time.perf_counter()
+            groups = len(run())
+            timings.append(time.perf_counter() - started)
+        print(f"{rows} rows by {len(dimensions)} dimension(s), {groups} groups: "
+              f"group_by {timings[0]:.2f}s, dict loop {timings[1]:.2f}s")
+
+
+def print_result(result, previous=None):
+    line = (f"{result['report']:<12}{result['users']:>8} users {result['seconds']:>9.2f}s "
+            f"{result['requests']:>7} req ({result['throttled']} throttled) "
+            f"{result['requests_per_second'] or 0:>8.1f} req/s "
+            + (f"{result['peak_rss_mb']:>8.1f} MB" if result['peak_rss_mb'] is not None else f"{'-':>8} MB"))
+    if previous:
+        line += "   vs before: " + ", ".join(
+            f"{key} {change(previous[key], result[key])}" for key in ('seconds', 'requests', 'peak_rss_mb'))
+    print(line if result['ok'] else line + "  FAILED")
+
+
+def change(before, after):
+    if not before or after is None:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.0f}%"
+
+
+def load_results(path):
+    """Latest result per (report, users, backend, cache) from a results file."""
+    latest = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            result = json.loads(line)
+            latest[(result['report'], result['users'], result['backend'], result['cache'])] = result
+    return latest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the report scripts against a local fake Okta org.")
+    parser.add_argument('--sizes', default="1000,5000", help="comma separated user counts")
+    parser.add_argument('--reports', default=",".join(REPORTS), help="comma separated: " + ", ".join(REPORTS))
+    parser.add_argument('--apps', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds added to every request")
+    parser.add_argument('--window', type=int, default=1, help="rate limit window in seconds")
+    parser.add_argument('--cache', choices=['cold', 'warm', 'off'], default='cold',
+                        help="user cache: new per report, shared per org size, or disabled")
+    parser.add_argument('--churn', type=float, default=0.0,
+                        help="fraction of users given a new FastPass device before each report")
+    parser.add_argument('--in-process', action='store_true', help="run reports in this process, not as scripts")
+    parser.add_argument('--aggregate', type=int, metavar='ROWS', help="time the aggregate engine on ROWS users instead")
+    parser.add_argument('--output', default=DEFAULT_RESULTS_PATH, help="results file to append to")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+    if args.aggregate:
+        benchmark_aggregate(args.aggregate, args.seed)
+        return
+    args.reports = [name.strip() for name in args.reports.split(',') if name.strip()]
+    for name in args.reports:
+        if name not in REPORTS:
+            parser.error(f"unknown report {name!r}")
+
+    results = []
+    for users in (int(size) for size in args.sizes.split(',')):
+        results.extend(run_size(users, args))
+
+    with open(args.output, 'a', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+    print(f"Results appended to {args.output}")
+
+    if args.compare:
+        previous = load_results(args.compare)
+        print(f"\nCompared with {args.compare}:")
+        for result in results:
+            print_result(result, previous.get((result['report'], result['users'], result['backend'], result['cache'])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Bulk deactivate/delete of Okta users with a resumable progress journal.
+
+Deleting a user takes two calls: the first DELETE deactivates an active
+user, the second removes the deactivated user. Every finished step is
+appended to a journal file and flushed to disk before the next one
+starts, so an interrupted run picks up exactly where it stopped. Once a
+wipe finishes without failures the journal is set aside, so the next
+wipe starts from a clean one.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from checkpoint import read_jsonl
+
+
+DEFAULT_JOURNAL_PATH = os.path.expanduser("~/.okta-scripts/wipe-journal.jsonl")
+DEFAULT_WORKERS = 4
+STEPS = ('deactivate', 'delete')
+
+
+class Journal:
+    """Append-only JSON lines record of completed lifecycle steps."""
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH):
+        self.path = path
+        self.done = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            for entry in read_jsonl(path):
+                if entry.get('ok'):
+                    self.done.setdefault(entry['user_id'], set()).add(entry['step'])
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def finish(self):
+        """The wipe completed; keep the journal under a dated name and start the next one empty."""
+        self.close()
+        finished = self.path + time.strftime('.%Y%m%d-%H%M%S')
+        os.replace(self.path, finished)
+        print(f"Wipe complete; journal moved to {finished}")
+
+    def is_done(self, user_id, step):
+        return step in self.done.get(user_id, ())
+
+    def record(self, user_id, step, ok, status_code=None, detail=None):
+        entry = {'user_id': user_id, 'step': step, 'ok': ok, 'status': status_code,
+                 'detail': detail, 'time': time.time()}
+        with self.lock:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            if ok:
+                self.done.setdefault(user_id, set()).add(step)
+
+
+def plan_steps(user, journal):
+    """Lifecycle steps still needed for a user, from their current status.
+
+    Only the status says what the next DELETE will do: a user the journal
+    shows as deactivated may have been reactivated since. A DEPROVISIONED
+    user is only deleted if the journal shows this wipe deactivated it;
+    users deprovisioned some other way are left alone.
+    """
+    if user.get('status') != 'DEPROVISIONED':
+        return list(STEPS)
+    return ['delete'] if journal.is_done(user['id'], 'deactivate') else []
+
+
+def run_steps(client, user, steps, journal):
+    """Run the remaining steps for one user; return True once the user is deleted."""
+    url = f"/api/v1/users/{user['id']}?sendEmail=false"
+    for step in steps:
+        response = client.request("DELETE", url)
+        # 404 means an earlier, unjournaled attempt already finished the job
+        ok = response.status_code in (200, 202, 204, 404)
+        detail = None if ok else response.text[:500]
+        journal.record(user['id'], step, ok, response.status_code, detail)
+        if not ok:
+            print(f"{step} failed for {user['profile'].get('login', user['id'])}: {response.status_code} {detail}")
+            return False
+        if response.status_code == 404:
+            journal.record(user['id'], 'delete', True, 404)
+            return True
+    return True
+
+
+def print_plan(users, journal):
+    """Dry run: show what a wipe would do without calling Okta."""
+    total_calls = 0
+    for user in users:
+        steps = plan_steps(user, journal)
+        total_calls += len(steps)
+        if steps:
+            print(f"{user['profile'].get('login', user['id'])}: {', '.join(steps)}")
+    print(f"Plan: {len(users)} users, {total_calls} API calls")
+    return total_calls
+
+
+def deprovision_users(client, users, journal, max_workers=DEFAULT_WORKERS):
+    """Deactivate and delete users in parallel under the client's rate governor.
+
+    Returns (deleted user ids, failed user ids). Failures do not stop the run;
+    rerunning with the same journal retries only what is left.
+    """
+    deleted, failed = [], []
+    work = [(user, plan_steps(user, journal)) for user in users]
+    work = [(user, steps) for user, steps in work if steps]
+    print(f"{len(work)} users to go")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_steps, client, user, steps, journal): user for user, steps in work}
+        for count, future in enumerate(as_completed(futures), 1):
+            user = futures[future]
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"Error deprovisioning {user['id']}: {e}")
+                ok = False
+            (deleted if ok else failed).append(user['id'])
+            if count % 100 == 0:
+                print(f"Progress: {count}/{len(work)}")
+    print(f"Deleted {len(deleted)} users, {len(failed)} failed")
+    return deleted, failed
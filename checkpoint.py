@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""Checkpoint files that let a long report pick up where a failed run stopped.
+
+A report saves the result of every finished sub-crawl (one app's members,
+one user's factors) under a key. Rerunning with --resume loads those
+results instead of fetching them again; a normal run starts a fresh file.
+The file is removed once the report completes.
+"""
+import json
+import os
+import threading
+
+
+DEFAULT_CHECKPOINT_DIR = os.path.expanduser("~/.okta-scripts/checkpoints")
+
+
+def read_jsonl(path):
+    """Yield the entries of a JSON lines file written one flushed line at a time."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A crash can leave a half written last line
+                continue
+
+
+def checkpoint_path(name):
+    return os.path.join(os.getenv('OKTA_CHECKPOINT_DIR', DEFAULT_CHECKPOINT_DIR), f"{name}.jsonl")
+
+
+class Checkpoint:
+    """JSON lines file of finished sub-crawl results keyed by name."""
+
+    def __init__(self, name, resume=False):
+        self.path = checkpoint_path(name)
+        self.results = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(self.path):
+            for entry in read_jsonl(self.path):
+                self.results[entry['key']] = entry['result']
+            print(f"Resuming: {len(self.results)} finished steps loaded from {self.path}")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+
+    def __contains__(self, key):
+        return key in self.results
+
+    def get(self, key, default=None):
+        return self.results.get(key, default)
+
+    def save(self, key, result):
+        """Record a finished sub-crawl; safe to call from worker threads."""
+        with self.lock:
+            self.results[key] = result
+            self.file.write(json.dumps({'key': key, 'result': result}) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def finish(self):
+        """The report completed; the checkpoint is no longer needed."""
+        self.close()
+        os.remove(self.path)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Compare two snapshots (see snapshot.py) and report what changed, for access reviews.
+
+Every row is first reduced to one hash of its key and compared columns,
+and rows whose hash is on both sides are set aside as unchanged with set
+operations that run in C. The few rows left are matched on their key
+columns with a sorted merge (both sides sorted by key once, then walked
+together) and compared field by field. Changes are written to the report
+as they are found.
+
+The report is a CSV with one line per added or removed row and one per
+changed field:
+
+    table,change,key,name,field,old,new
+    users,changed,00u1abc,ann.lee@example.com,profile.department,Sales,Finance
+    assignments,added,00u1abc / 0oa2def,ann.lee@example.com / Salesforce,,,
+    factors,removed,00u1abc / mfa3ghi,ann.lee@example.com / macos-4f2a,,,
+"""
+import collections
+import csv
+import operator
+from itertools import compress
+
+
+# Key columns of each table, and columns left out of the comparison
+TABLE_KEYS = {
+    'users': (['id'], ['lastUpdated']),
+    'apps': (['id'], []),
+    'groups': (['id'], []),
+    'assignments': (['user_id', 'app_id'], []),
+    'factors': (['user_id', 'id'], []),
+}
+REPORT_FIELDS = ['table', 'change', 'key', 'name', 'field', 'old', 'new']
+
+
+def row_keys(columns, key_columns, rows):
+    """Key of each of rows, by row index."""
+    if len(key_columns) == 1:
+        values = columns[key_columns[0]]
+        return {row: values[row] for row in rows}
+    key_values = [columns[column] for column in key_columns]
+    return {row: tuple(values[row] for values in key_values) for row in rows}
+
+
+def row_digests(columns, fields):
+    """One hash per row over fields, so unchanged rows are recognised without comparing each field."""
+    return list(map(hash, zip(*(columns[field] for field in fields))))
+
+
+def changed_rows(digests, unchanged):
+    """Indexes of the rows whose digest is not in unchanged."""
+    return list(compress(range(len(digests)), map(operator.not_, map(unchanged.__contains__, digests))))
+
+
+def merge_join(old_keys, new_keys, old_rows, new_rows):
+    """Yield (old row, new row) index pairs of the given rows in key order; None on the side a key is missing from."""
+    old_order = sorted(old_rows, key=old_keys.__getitem__)
+    new_order = sorted(new_rows, key=new_keys.__getitem__)
+    i = j = 0
+    while i < len(old_order) and j < len(new_order):
+        old_row, new_row = old_order[i], new_order[j]
+        old_key, new_key = old_keys[old_row], new_keys[new_row]
+        if old_key == new_key:
+            yield old_row, new_row
+            i += 1
+            j += 1
+        elif old_key < new_key:
+            yield old_row, None
+            i += 1
+        else:
+            yield None, new_row
+            j += 1
+    for old_row in old_order[i:]:
+        yield old_row, None
+    for new_row in new_order[j:]:
+        yield None, new_row
+
+
+def key_text(key):
+    return " / ".join(key) if isinstance(key, tuple) else key
+
+
+def diff_table(name, old, new, describe=None):
+    """Yield report rows for the differences between two versions of a table's columns."""
+    key_columns, ignored = TABLE_KEYS[name]
+    fields = [field for field in new if field in old and field not in key_columns and field not in ignored]
+    old_digests, new_digests = row_digests(old, key_columns + fields), row_digests(new, key_columns + fields)
+    unchanged = set(old_digests).intersection(new_digests)
+    old_rows, new_rows = changed_rows(old_digests, unchanged), changed_rows(new_digests, unchanged)
+    del old_digests, new_digests, unchanged
+    old_keys, new_keys = row_keys(old, key_columns, old_rows), row_keys(new, key_columns, new_rows)
+    describe = describe or (lambda key: '')
+
+    for old_row, new_row in merge_join(old_keys, new_keys, old_rows, new_rows):
+        if new_row is None:
+            key = old_keys[old_row]
+            yield {'table': name, 'change': 'removed', 'key': key_text(key), 'name': describe(key)}
+        elif old_row is None:
+            key = new_keys[new_row]
+            yield {'table': name, 'change': 'added', 'key': key_text(key), 'name': describe(key)}
+        else:
+            key = new_keys[new_row]
+            for field in fields:
+                before, after = old[field][old_row], new[field][new_row]
+                if before != after:
+                    yield {'table': name, 'change': 'changed', 'key': key_text(key), 'name': describe(key),
+                           'field': field, 'old': before, 'new': after}
+
+
+def describers(old, new):
+    """Functions giving a readable name (login, app label) for each table's keys."""
+    names = {}
+    for snapshot in (old, new):
+        if 'users' in snapshot:
+            users = snapshot.read('users')
+            names.update(zip(users['id'], users['profile.login']))
+        if 'apps' in snapshot:
+            apps = snapshot.read('apps')
+            names.update(zip(apps['id'], apps['label']))
+        if 'groups' in snapshot:
+            groups = snapshot.read('groups')
+            names.update(zip(groups['id'], groups['name']))
+    factor_names = {}
+    for snapshot in (old, new):
+        if 'factors' in snapshot:
+            factors = snapshot.read('factors')
+            factor_names.update(zip(zip(factors['user_id'], factors['id']), factors['name']))
+
+    def describe_one(key):
+        return names.get(key, '')
+
+    def describe_pair(key):
+        return f"{names.get(key[0], '')} / {names.get(key[1], '')}"
+
+    def describe_factor(key):
+        return f"{names.get(key[0], '')} / {factor_names.get(key, '')}"
+
+    return {'users': describe_one, 'apps': describe_one, 'groups': describe_one,
+            'assignments': describe_pair, 'factors': describe_factor}
+
+
+def diff_snapshots(old, new, tables=None):
+    """Yield report rows for every table both snapshots have (or those in tables)."""
+    describe = describers(old, new)
+    for name in tables or TABLE_KEYS:
+        if name not in old or name not in new:
+            print(f"Skipping {name}: not in both snapshots")
+            continue
+        yield from diff_table(name, old.read(name), new.read(name), describe[name])
+
+
+def write_change_report(changes, output_path):
+    """Stream report rows to a CSV and return how many changes of each kind there were per table."""
+    counts = collections.Counter()
+    with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        for change in changes:
+            writer.writerow(change)
+            counts[(change['table'], change['change'])] += 1
+    print(f"Change report written to {output_path}")
+    for (table, change), number in sorted(counts.items()):
+        print(f"  {table:<12}{change:<9}{number:>8}")
+    return counts
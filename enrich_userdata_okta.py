@@ -3,93 +3,83 @@ import requests
 import csv
 import json
 import os
-import time
-from copy import deepcopy
 from dotenv import load_dotenv
+from okta_client import OktaClient
+from match_index import MatchIndex, block_keys, name_key, score_names
+from user_cache import UserCache, cache_path, synced_cache
+from user_query import UserQuery
 
 
-load_dotenv()
-
-OKTA_ORG_URL = os.getenv('OKTA_ORG_URL')
-OKTA_API_KEY = os.getenv('OKTA_API_KEY')
-
-if not OKTA_ORG_URL or not OKTA_API_KEY:
-    raise ValueError("Missing required environment variables. Please check your .env file.")
-
 DEFAULT_OUTPUT_DIR = os.path.expanduser("~/Documents")
+# Like the plain /users listing the script always matched against, leave out DEPROVISIONED users
+USER_QUERY = UserQuery(exclude_statuses=["DEPROVISIONED"],
+                       fields=('email', 'secondEmail', 'login', 'firstName', 'lastName', 'department'))
+# Lowest name similarity accepted by the opt-in fuzzy pass (ENRICH_FUZZY=1)
+FUZZY_THRESHOLD = 0.88
+EMAIL_MATCH_TYPES = [('email', 'Email'), ('secondEmail', 'Secondary Email'), ('login', 'Login')]
 
 def get_users(import_file):
-    """Read CSV file and return list of dictionaries."""
+    """Read CSV file one row at a time as dictionaries."""
     with open(import_file, 'r', encoding='utf-8-sig') as f:
-        return list(csv.DictReader(f))
+        yield from csv.DictReader(f)
 
 def export_to_csv(data, output_path):
-    """Write list of dictionaries to CSV file."""
-    if not data:
+    """Write dictionaries to CSV file as they are produced."""
+    records = iter(data)
+    first = next(records, None)
+    if first is None:
         print("No data to export!")
         return
 
     # Get fieldnames from the first record
-    fieldnames = list(data[0].keys())
+    fieldnames = list(first.keys())
     
     with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
-        for record in data:
+        writer.writerow(first)
+        for record in records:
             writer.writerow(record)
     print(f"Successfully exported to {output_path}")
 
-def get_all_okta_users(token):
-    """Fetch all Okta users with pagination and rate limiting."""
-    headers = {
-        'Accept': 'application/json',
-        'Content-Type': 'application/json',
-        'Authorization': f'SSWS {token}'
-    }
-    
-    users = []
-    url = f"{OKTA_ORG_URL}/api/v1/users?limit=200"
-    
-    while url:
-        print(f"Fetching: {url}")
+def get_match_index(client):
+    """Sync the user cache and return it as the match index.
+
+    Falls back to the previous sync if Okta cannot be reached, as long as
+    that sync finished, and to an in-memory index when the cache is
+    switched off.
+    """
+    if cache_path() == 'off':
         try:
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            rate_limit_remaining = int(response.headers.get('x-rate-limit-remaining', 1))
-            if rate_limit_remaining <= 1:
-                current_time = int(time.time())
-                reset_time = int(response.headers.get('x-rate-limit-reset', current_time + 60))
-                sleep_duration = reset_time - current_time + 1
-                sleep_duration = max(sleep_duration, 0)
-                print(f"Rate limit approaching. Sleeping {sleep_duration} seconds")
-                time.sleep(sleep_duration)
-            users.extend(response.json())
-            
-            link_header = response.headers.get('link', '')
-            url = None
-            for link in link_header.split(','):
-                if 'rel="next"' in link:
-                    url = link.split(';')[0].strip(' <>')
-            
+            return MatchIndex(client.iter_users(USER_QUERY))
         except requests.exceptions.RequestException as e:
             print(f"Error fetching users: {e}")
-            break
-            
-    return users
-
-def get_okta_info(user_list, all_okta_users):
-    """Match local users with Okta users by email."""
-    email_map = {user['profile']['email'].lower(): user for user in all_okta_users if 'email' in user['profile']}
-    
-    enriched_users = []
+            return None
+    try:
+        return synced_cache(client)
+    except requests.exceptions.RequestException as e:
+        cache = UserCache()
+        if not cache.is_complete(client.org_url):
+            # Matching against part of the org would report real people as not found
+            cache.close()
+            raise
+        print(f"Error fetching users: {e}")
+        print(f"Using the {cache.count()} users from the last successful sync")
+        return cache
+
+def get_okta_info(user_list, index):
+    """Match local users with Okta users by email, secondary email or login, one row at a time."""
     for user in user_list:
         email = user.get('Email', '').lower()
-        okta_user = email_map.get(email)
-        
-        if okta_user:
-            enriched = process_okta_user(okta_user, user, "Email")
-        else:
+        enriched = None
+        for kind, match_type in EMAIL_MATCH_TYPES:
+            matches = index.lookup(kind, email, USER_QUERY) if email else []
+            if matches:
+                # Duplicate addresses resolve to the last user, as the old email map did
+                enriched = process_okta_user(matches[-1], user, match_type)
+                break
+
+        if enriched is None:
             enriched = {
                 **user,
                 'Department': 'N/A',
@@ -98,39 +88,63 @@ def get_okta_info(user_list, all_okta_users):
                 'Okta Email': 'N/A'
             }
         
-        enriched_users.append(enriched)
-    return enriched_users
-
-def search_by_name(user_list, all_okta_users):
-    """Search for unmatched users by first/last name in local data."""
-    name_map = {}
-    for okta_user in all_okta_users:
-        profile = okta_user.get('profile', {})
-        key = (profile.get('firstName', '').lower(), 
-               profile.get('lastName', '').lower())
-        if key[0] and key[1]:
-            name_map.setdefault(key, []).append(okta_user)
-    
-    results = []
+        yield enriched
+
+def search_by_name(user_list, index):
+    """Search for unmatched users by first/last name in the match index, one row at a time."""
     for user in user_list:
         if user['Match Type'] != 'No match found':
-            results.append(user)
+            yield user
             continue
 
-        first = user.get('First', '').lower()
-        last = user.get('Last', '').lower()
-        matches = name_map.get((first, last), [])
+        key = name_key(user.get('First', ''), user.get('Last', ''))
+        matches = index.lookup('name', key, USER_QUERY) if key else []
         
         if len(matches) == 1:
-            processed = process_okta_user(matches[0], user, "First and Last")
-            results.append(processed)
+            yield process_okta_user(matches[0], user, "First and Last")
         elif len(matches) > 1:
+            # process_okta_user builds a new dict, so the row can be shared
             for match in matches:
-                processed = process_okta_user(match, deepcopy(user), "Multiple Matches")
-                results.append(processed)
+                yield process_okta_user(match, user, "Multiple Matches")
         else:
-            results.append(user)
-    return results
+            yield user
+
+def search_by_fuzzy_name(user_list, index, threshold=None):
+    """Fuzzy-match rows that are still unmatched after the exact passes, one row at a time.
+
+    Every row gains a Match Score column: 1.00 for exact matches, the
+    similarity for fuzzy ones and blank when nothing matched. Candidates
+    come from the name blocking keys, so each row is scored against a few
+    users rather than the whole org, and each distinct name among them is
+    scored once.
+    """
+    threshold = FUZZY_THRESHOLD if threshold is None else threshold
+    for user in user_list:
+        if user['Match Type'] != 'No match found':
+            yield {**user, 'Match Score': '1.00'}
+            continue
+
+        first, last = user.get('First', ''), user.get('Last', '')
+        candidates = {}
+        # Sorted, so candidates and ties come out in the same order on every run
+        for key in sorted(block_keys(first, last)):
+            for okta_user in index.lookup('name_block', key, USER_QUERY):
+                candidates[okta_user['id']] = okta_user
+
+        candidates = list(candidates.values())
+        names = [(okta_user['profile'].get('firstName'), okta_user['profile'].get('lastName'))
+                 for okta_user in candidates]
+        scored = [(score, okta_user) for score, okta_user in zip(score_names(first, last, names), candidates)
+                  if score >= threshold]
+
+        if not scored:
+            yield {**user, 'Match Score': ''}
+            continue
+        best = max(score for score, _ in scored)
+        best_matches = [okta_user for score, okta_user in scored if score == best]
+        match_type = "Fuzzy Name" if len(best_matches) == 1 else "Multiple Fuzzy Matches"
+        for okta_user in best_matches:
+            yield {**process_okta_user(okta_user, user, match_type), 'Match Score': f"{best:.2f}"}
 
 def process_okta_user(okta_user, local_user, match_type):
     """Process Okta user data and update local user record."""
@@ -143,12 +157,53 @@ def process_okta_user(okta_user, local_user, match_type):
         'Okta Email': profile.get('email', 'N/A')
     }
 
+def kept(rows, keep):
+    """Pass rows through, appending each one to keep."""
+    for row in rows:
+        keep.append(row)
+        yield row
+
+def write_enriched(index, input_path, output_path, fuzzy=False, keep=None):
+    """Match every row of input_path against index and write the results to output_path.
+
+    If keep is a list the written rows are also appended to it, so a
+    following report can use them without reading the file back.
+    """
+    # Each stage is a generator, so rows are written as soon as they are matched
+    users = get_users(input_path)
+    email_matched = get_okta_info(users, index)
+    final_results = search_by_name(email_matched, index)
+    if fuzzy:
+        final_results = search_by_fuzzy_name(final_results, index)
+    if keep is not None:
+        final_results = kept(final_results, keep)
+    export_to_csv(final_results, output_path)
+
+def enrich_file(client, input_path, output_path, fuzzy=False, keep=None):
+    """Non-interactive enrich run; returns False if the Okta users could not be loaded."""
+    print("Fetching all Okta users...")
+    index = get_match_index(client)
+    if index is None or not index.count():
+        print("Failed to fetch Okta users")
+        return False
+    write_enriched(index, input_path, output_path, fuzzy, keep)
+    return True
+
 def main():
     """Main execution flow."""
+    load_dotenv()
+
+    OKTA_ORG_URL = os.getenv('OKTA_ORG_URL')
+    OKTA_API_KEY = os.getenv('OKTA_API_KEY')
+
+    if not OKTA_ORG_URL or not OKTA_API_KEY:
+        raise ValueError("Missing required environment variables. Please check your .env file.")
+
     try:
         print("Fetching all Okta users...")
-        all_okta_users = get_all_okta_users(OKTA_API_KEY)
-        if not all_okta_users:
+        with OktaClient(OKTA_ORG_URL, OKTA_API_KEY, timeout=10) as client:
+            index = get_match_index(client)
+        if index is None or not index.count():
             print("Failed to fetch Okta users")
             return
     except Exception as e:
@@ -166,12 +221,9 @@ def main():
     output_path = os.path.join(DEFAULT_OUTPUT_DIR, f"{output_name}.csv")
 
     try:
-        users = get_users(input_path)
-        email_matched = get_okta_info(users, all_okta_users)
-        final_results = search_by_name(email_matched, all_okta_users)
-        export_to_csv(final_results, output_path)
+        write_enriched(index, input_path, output_path, os.getenv('ENRICH_FUZZY') == '1')
     except Exception as e:
         print(f"Error occurred: {str(e)}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""On-disk inventory of every user's factors, so factor reports only fetch what changed.
+
+Enrolling or removing a factor does not move a user's lastUpdated, so a
+stored entry is fetched again when any of these holds:
+
+- the user is not in the inventory yet, or their lastUpdated moved
+- the entry is older than OKTA_FACTOR_TTL seconds (default a week)
+- the System Log has a factor event for the user since the last run
+
+The System Log is read from the watermark of the last completed run of
+the same scope. Reports that cover different users (fastpass only reads
+some user types, snapshot reads everyone) keep separate watermarks, as a
+run only vouches for the users it refreshed. If the log cannot be read
+(the token has no access to it, say) every user is fetched, as on the
+first run.
+"""
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+import requests
+
+
+DEFAULT_INVENTORY_PATH = os.path.expanduser("~/.okta-scripts/factors.sqlite3")
+DEFAULT_TTL = 7 * 24 * 3600
+# System Log events that change what /users/{id}/factors returns
+FACTOR_EVENTS = [
+    "user.mfa.factor.activate",
+    "user.mfa.factor.deactivate",
+    "user.mfa.factor.reset_all",
+    "user.mfa.factor.suspend",
+    "user.mfa.factor.unsuspend",
+    "user.mfa.factor.update",
+]
+# Events can show up in the log a little after they happen, so re-read this much of the last window
+LOG_OVERLAP = timedelta(minutes=5)
+LOGS_PAGE_SIZE = 1000
+# Fetched entries written per transaction
+COMMIT_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS factors (
+    user_id TEXT PRIMARY KEY,
+    last_updated TEXT,
+    fetched_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def inventory_path():
+    """Location of the inventory, overridable with OKTA_FACTOR_CACHE ('off' to always fetch)."""
+    return os.getenv('OKTA_FACTOR_CACHE', DEFAULT_INVENTORY_PATH)
+
+
+def timestamp(moment):
+    """ISO 8601 in UTC with milliseconds, as the System Log expects."""
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+def parse_timestamp(value):
+    return datetime.strptime(value.rstrip('Z'), '%Y-%m-%dT%H:%M:%S.%f').replace(tzinfo=timezone.utc)
+
+
+class FactorInventory:
+    """SQLite store of factor lists by user id for one org."""
+
+    def __init__(self, path=None, ttl=None, clock=time.time, scope='fastpass'):
+        self.path = path or inventory_path()
+        self.scope = scope
+        self.ttl = float(os.getenv('OKTA_FACTOR_TTL', DEFAULT_TTL)) if ttl is None else ttl
+        self.clock = clock
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+        self.changed = None
+        self.started = None
+        self.unsaved = 0
+        self.fetched = 0
+        self.reused = 0
+        # Rows kept from an interrupted run that the System Log could not vouch for
+        self.unvouched = 0
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def begin(self, client):
+        """Start a run: note its start time and read which users' factors changed since the last one."""
+        self.started = datetime.now(timezone.utc)
+        if self.get_meta('org_url') not in (None, client.org_url):
+            print("Factor inventory belongs to a different org; starting over")
+            with self.db:
+                self.db.execute("DELETE FROM factors")
+                self.db.execute("DELETE FROM meta")
+        with self.db:
+            self.set_meta('org_url', client.org_url)
+        self.changed = self.changed_users(client)
+        if self.changed is not None:
+            print(f"System Log: {len(self.changed)} users with factor changes since the last run")
+
+    def changed_users(self, client):
+        """Ids of users with factor events since the watermark, or None if every user must be fetched."""
+        watermark = self.get_meta(self.watermark_key)
+        if watermark is None:
+            return None
+        params = {
+            'since': timestamp(parse_timestamp(watermark) - LOG_OVERLAP),
+            # Without until the log keeps returning a next link to poll
+            'until': timestamp(self.started),
+            'filter': " or ".join(f'eventType eq "{event}"' for event in FACTOR_EVENTS),
+            'limit': LOGS_PAGE_SIZE,
+        }
+        try:
+            return {
+                target['id']
+                for event in client.iter_items("/api/v1/logs", params=params)
+                for target in event.get('target') or []
+                if target.get('type') == 'User'
+            }
+        except requests.exceptions.RequestException as e:
+            print(f"Could not read factor events from the System Log ({e}); fetching every user's factors")
+            return None
+
+    @property
+    def watermark_key(self):
+        return f"log_watermark:{self.scope}"
+
+    def needs_refresh(self, user):
+        """True if user's stored factors may be out of date."""
+        row = self.db.execute("SELECT last_updated, fetched_at FROM factors WHERE user_id = ?",
+                              (user['id'],)).fetchone()
+        if row is None or row[0] != user.get('lastUpdated') or row[1] + self.ttl <= self.clock():
+            return True
+        return self.changed is None or user['id'] in self.changed
+
+    def keeps_resumed(self, user):
+        """True if the factors an interrupted run already reported for user can be kept.
+
+        Not when the System Log has a change for the user since. Without the
+        log there is no telling, so the row is kept but this run will not move
+        the watermark past events it did not look at.
+        """
+        if self.changed is None:
+            self.unvouched += 1
+            return True
+        return user['id'] not in self.changed
+
+    def get(self, user_id):
+        """Stored factors of a user."""
+        row = self.db.execute("SELECT data FROM factors WHERE user_id = ?", (user_id,)).fetchone()
+        self.reused += 1
+        return json.loads(row[0])
+
+    def save(self, user, factors):
+        """Store factors just fetched for user."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO factors (user_id, last_updated, fetched_at, data) VALUES (?, ?, ?, ?)",
+            (user['id'], user.get('lastUpdated'), self.clock(), json.dumps(factors))
+        )
+        self.fetched += 1
+        self.unsaved += 1
+        if self.unsaved >= COMMIT_EVERY:
+            self.db.commit()
+            self.unsaved = 0
+
+    def finish(self):
+        """The run covered every user in its scope; later runs of it only need log events from its start."""
+        if self.unvouched:
+            print(f"Factor inventory: {self.unvouched} rows came from an interrupted run; System Log position kept")
+        else:
+            with self.db:
+                self.set_meta(self.watermark_key, timestamp(self.started))
+        print(f"Factor inventory: {self.fetched} users fetched, {self.reused} unchanged")
+        self.close()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+
+def open_inventory(client, scope, path=None):
+    """Open the inventory and begin a run over scope's users, or return None when OKTA_FACTOR_CACHE=off."""
+    path = path or inventory_path()
+    if path == 'off':
+        return None
+    inventory = FactorInventory(path, scope=scope)
+    inventory.begin(client)
+    return inventory
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Okta API, for benchmarks and for trying scripts safely.
+
+SyntheticOrg generates a reproducible org (users, apps, groups, factors and
+assignments) from a seed. FakeOkta serves it over HTTP on localhost with
+the parts of the API the scripts use:
+
+    GET    /api/v1/users                 search=, limit, after
+    DELETE /api/v1/users/{id}            deactivate, then delete
+    GET    /api/v1/users/{id}/factors
+    GET    /api/v1/apps                  filter=status eq / user.id eq
+    GET    /api/v1/apps/{id}/users
+    GET    /api/v1/groups                search=profile.name sw, expand=stats
+    GET    /api/v1/groups/{id}/users
+    GET    /api/v1/logs                  since, until, filter=eventType eq
+
+SyntheticOrg.enroll_fastpass adds a device to a user and logs a factor
+event for it, to try incremental factor reports.
+
+Collections are paginated with Link headers like Okta's. Every response
+carries x-rate-limit-* headers for its endpoint family, requests over the
+limit get a 429, and an optional latency is added to each request.
+
+Run it on its own and point OKTA_ORG_URL at it:
+    python fake_okta.py --users 5000 --apps 100 --port 8080
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from factor_inventory import timestamp
+from rate_governor import DEFAULT_LIMITS, bucket_for
+
+
+DEFAULT_WINDOW = 60
+# Largest page each collection serves, and the page size when limit is not given
+PAGE_SIZES = {
+    '/api/v1/users': (200, 200),
+    '/api/v1/apps': (200, 20),
+    '/api/v1/apps/*/users': (500, 50),
+    '/api/v1/groups': (200, 200),
+    '/api/v1/groups/*/users': (1000, 1000),
+    '/api/v1/logs': (1000, 100),
+}
+
+FIRST_NAMES = ['James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David',
+               'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas',
+               'Sarah', 'Chris', 'Karen', 'Daniel', 'Nancy', 'Matt', 'Lisa', 'José', 'Zoë']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+              'Martinez', 'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor',
+              'Moore', 'Jackson', 'Martin', 'Lee', 'Perez', 'Thompson', 'White', "O'Brien", 'Smith-Jones']
+DEPARTMENTS = ['Engineering', 'Sales', 'Marketing', 'Finance', 'HR', 'IT', 'Legal', 'Support', 'Operations']
+USER_TYPES = ['Full Time'] * 6 + ['Contractor', 'Contractor - 1099', 'Contractor-1099', 'Intern', 'Vendor']
+STATUSES = ['ACTIVE'] * 17 + ['SUSPENDED', 'STAGED', 'DEPROVISIONED']
+FASTPASS_PLATFORMS = ['MACOS', 'WINDOWS', 'IOS', 'ANDROID']
+
+
+class SyntheticOrg:
+    """A generated org: the same arguments always give the same users and assignments."""
+
+    def __init__(self, users=1000, apps=50, groups=20, seed=0, apps_per_user=8):
+        rng = random.Random(seed)
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.users = []
+        for i in range(users):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            login = f"{first.lower()}.{re.sub('[^a-z]', '', last.lower())}{i}@example.com"
+            self.users.append({
+                'id': f"00u{i:08d}",
+                'status': rng.choice(STATUSES),
+                'created': timestamp(start),
+                'lastUpdated': timestamp(start + timedelta(seconds=i)),
+                'profile': {
+                    'login': login, 'email': login, 'firstName': first, 'lastName': last,
+                    'userType': rng.choice(USER_TYPES), 'department': rng.choice(DEPARTMENTS),
+                    'title': 'Staff', 'manager': None, 'organization': 'Example',
+                },
+                'credentials': {'provider': {'type': 'OKTA', 'name': 'OKTA'}},
+            })
+        self.apps = [{'id': f"0oa{j:08d}", 'label': f"App {j:04d}", 'status': 'ACTIVE' if j % 10 else 'INACTIVE'}
+                     for j in range(apps)]
+        self.app_users = {app['id']: [] for app in self.apps}
+        for user in self.users:
+            for app in rng.sample(self.apps, min(len(self.apps), rng.randint(0, apps_per_user * 2))):
+                self.app_users[app['id']].append(user['id'])
+        self.groups = [{'id': f"00g{k:08d}", 'profile': {'name': f"dept-{department}"}}
+                       for k, department in enumerate(DEPARTMENTS[:groups])]
+        self.groups += [{'id': f"00g{k:08d}", 'profile': {'name': f"Team {k:04d}"}}
+                        for k in range(len(self.groups), groups)]
+        self.group_users = {group['id']: [] for group in self.groups}
+        for user in self.users:
+            for group in self.groups:
+                if group['profile']['name'] == f"dept-{user['profile']['department']}":
+                    self.group_users[group['id']].append(user['id'])
+        self.factors = {}
+        for user in self.users:
+            factors = [{'id': f"mfa{user['id']}p", 'factorType': 'push', 'status': 'ACTIVE', 'profile': {}}]
+            for n in range(rng.choice([0, 0, 1, 1, 2])):
+                platform = rng.choice(FASTPASS_PLATFORMS)
+                factors.append({'id': f"mfa{user['id']}{n}", 'factorType': 'signed_nonce', 'status': 'ACTIVE',
+                                'profile': {'platform': platform, 'name': f"{platform.lower()}-{user['id'][-4:]}-{n}"}})
+            self.factors[user['id']] = factors
+        self.users_by_id = {user['id']: user for user in self.users}
+        self.apps_by_user = {}
+        for app in self.apps:
+            for user_id in self.app_users[app['id']]:
+                self.apps_by_user.setdefault(user_id, []).append(app)
+        # System Log events, oldest first
+        self.events = []
+        # Search results by expression, so paging through one costs a single scan
+        self.searches = {}
+        self.lock = threading.Lock()
+
+    def enroll_fastpass(self, user_id, platform='MACOS', when=None):
+        """Give a user another FastPass device and log it like Okta does."""
+        when = when or datetime.now(timezone.utc)
+        with self.lock:
+            factors = self.factors[user_id]
+            n = len(factors)
+            factors.append({'id': f"mfa{user_id}{n}", 'factorType': 'signed_nonce', 'status': 'ACTIVE',
+                            'profile': {'platform': platform, 'name': f"{platform.lower()}-{user_id[-4:]}-{n}"}})
+            self.events.append({
+                'uuid': f"evt{len(self.events):08d}",
+                'published': timestamp(when),
+                'eventType': 'user.mfa.factor.activate',
+                'target': [{'id': user_id, 'type': 'User'}],
+            })
+
+    def search_users(self, expression=None):
+        """Users matching a search; without one, everyone but DEPROVISIONED like Okta's listing."""
+        with self.lock:
+            if expression not in self.searches:
+                if expression:
+                    matches = parse_search(expression)
+                else:
+                    matches = lambda user: user['status'] != 'DEPROVISIONED'
+                self.searches[expression] = list(filter(matches, self.users))
+            return self.searches[expression]
+
+
+def parse_search(expression):
+    """Turn an Okta search/filter expression into a predicate over an object.
+
+    Supports eq, sw, gt, ge, lt and le comparisons on dotted attributes,
+    joined with and/or and grouped with parentheses.
+    """
+    tokens = re.findall(r'\(|\)|"(?:[^"\\]|\\.)*"|[^\s()"]+', expression)
+    position = 0
+
+    def peek():
+        return tokens[position].lower() if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def comparison():
+        if peek() == '(':
+            take()
+            predicate = disjunction()
+            take()
+            return predicate
+        attribute, operator, literal = take(), take().lower(), take()
+        value = json.loads(literal) if literal.startswith('"') else literal
+
+        def predicate(obj):
+            actual = obj
+            for key in attribute.split('.'):
+                actual = actual.get(key) if isinstance(actual, dict) else None
+            if actual is None:
+                return False
+            if operator == 'eq':
+                return actual == value
+            if operator == 'sw':
+                return str(actual).lower().startswith(str(value).lower())
+            return {'gt': actual > value, 'ge': actual >= value, 'lt': actual < value, 'le': actual <= value}[operator]
+        return predicate
+
+    def conjunction():
+        parts = [comparison()]
+        while peek() == 'and':
+            take()
+            parts.append(comparison())
+        return lambda obj: all(part(obj) for part in parts)
+
+    def disjunction():
+        parts = [conjunction()]
+        while peek() == 'or':
+            take()
+            parts.append(conjunction())
+        return lambda obj: any(part(obj) for part in parts)
+
+    return disjunction()
+
+
+class RateLimiter:
+    """Fixed window request counters per endpoint family, like Okta's."""
+
+    def __init__(self, limits, window):
+        self.limits = limits
+        self.window = window
+        self.windows = {}
+        self.lock = threading.Lock()
+
+    def check(self, bucket):
+        """Count a request; return (allowed, limit, remaining, reset epoch seconds)."""
+        limit = self.limits.get(bucket)
+        if limit is None:
+            return True, None, None, None
+        now = time.time()
+        with self.lock:
+            reset, used = self.windows.get(bucket, (0, 0))
+            if now >= reset:
+                reset, used = int(now) + self.window, 0
+            used += 1
+            self.windows[bucket] = (reset, used)
+        return used <= limit, limit, max(limit - used, 0), reset
+
+
+class FakeOkta:
+    """HTTP server for a SyntheticOrg on a background thread."""
+
+    def __init__(self, org=None, port=0, latency=0.0, limits=None, window=DEFAULT_WINDOW):
+        self.org = org or SyntheticOrg()
+        self.latency = latency
+        self.limiter = RateLimiter(DEFAULT_LIMITS if limits is None else limits, window)
+        self.counts = {}
+        self.throttled = 0
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+        handler = type('Handler', (FakeOktaHandler,), {'fake': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.counts = {}
+            self.throttled = 0
+            self.bytes_sent = 0
+
+    def total_requests(self):
+        return sum(self.counts.values())
+
+    def record(self, bucket, size, throttled):
+        with self.lock:
+            self.counts[bucket] = self.counts.get(bucket, 0) + 1
+            self.bytes_sent += size
+            self.throttled += throttled
+
+
+class FakeOktaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; Nagle would hold the body back
+    disable_nagle_algorithm = True
+    fake = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api('GET')
+
+    def do_DELETE(self):
+        self.handle_api('DELETE')
+
+    def handle_api(self, method):
+        url = urlparse(self.path)
+        bucket = bucket_for(url.path)
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        allowed, limit, remaining, reset = self.fake.limiter.check(bucket)
+        headers = {}
+        if limit is not None:
+            headers = {'x-rate-limit-limit': limit, 'x-rate-limit-remaining': remaining, 'x-rate-limit-reset': reset}
+        if not allowed:
+            return self.reply(bucket, 429, {'errorCode': 'E0000047', 'errorSummary': 'API call exceeded rate limit'},
+                              headers)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        status, body, extra = self.route(method, url.path, query)
+        headers.update(extra)
+        self.reply(bucket, status, body, headers)
+
+    def route(self, method, path, query):
+        org = self.fake.org
+        parts = path.strip('/').split('/')[2:]
+        if method == 'DELETE':
+            if len(parts) == 2 and parts[0] == 'users':
+                return self.delete_user(parts[1])
+            return 405, {'errorSummary': 'Method not allowed'}, {}
+        if parts == ['users']:
+            users = org.search_users(query.get('search'))
+            return self.page(path, query, users, '/api/v1/users')
+        if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'factors':
+            if parts[1] not in org.users_by_id:
+                return 404, {'errorSummary': 'Not found: Resource not found'}, {}
+            return 200, org.factors[parts[1]], {}
+        if parts == ['apps']:
+            apps = org.apps
+            expression = query.get('filter', '')
+            if expression.startswith('user.id eq '):
+                apps = org.apps_by_user.get(json.loads(expression[len('user.id eq '):]), [])
+            elif expression:
+                apps = list(filter(parse_search(expression), apps))
+            return self.page(path, query, apps, '/api/v1/apps')
+        if len(parts) == 3 and parts[0] == 'apps' and parts[2] == 'users':
+            if parts[1] not in org.app_users:
+                return 404, {'errorSummary': 'Not found: Resource not found'}, {}
+            users = [{'id': user_id, 'scope': 'USER'} for user_id in org.app_users[parts[1]]]
+            return self.page(path, query, users, '/api/v1/apps/*/users')
+        if parts == ['groups']:
+            groups = org.groups
+            if 'search' in query:
+                groups = list(filter(parse_search(query['search']), groups))
+            if query.get('expand') == 'stats':
+                groups = [{**group, '_embedded': {'stats': {'usersCount': len(org.group_users[group['id']])}}}
+                          for group in groups]
+            return self.page(path, query, groups, '/api/v1/groups')
+        if parts == ['logs']:
+            # Timestamps share one format, so they compare as strings
+            since, until = query.get('since', ''), query.get('until', '\uffff')
+            events = [event for event in org.events if since <= event['published'] < until]
+            if 'filter' in query:
+                events = list(filter(parse_search(query['filter']), events))
+            return self.page(path, query, events, '/api/v1/logs')
+        if len(parts) == 3 and parts[0] == 'groups' and parts[2] == 'users':
+            if parts[1] not in org.group_users:
+                return 404, {'errorSummary': 'Not found: Resource not found'}, {}
+            users = [org.users_by_id[user_id] for user_id in org.group_users[parts[1]] if user_id in org.users_by_id]
+            return self.page(path, query, users, '/api/v1/groups/*/users')
+        return 404, {'errorSummary': f'Not found: {path}'}, {}
+
+    def page(self, path, query, items, collection):
+        """One page of items starting at the after= cursor, with a Link to the next."""
+        largest, default = PAGE_SIZES[collection]
+        limit = min(int(query.get('limit', default)), largest)
+        after = int(query.get('after', 0))
+        headers = {}
+        if after + limit < len(items):
+            next_query = urlencode({**query, 'after': after + limit, 'limit': limit})
+            headers['Link'] = f'<{self.fake.url}{path}?{next_query}>; rel="next"'
+        return 200, items[after:after + limit], headers
+
+    def delete_user(self, user_id):
+        org = self.fake.org
+        with org.lock:
+            user = org.users_by_id.get(user_id)
+            if user is None:
+                return 404, {'errorSummary': 'Not found: Resource not found'}, {}
+            org.searches.clear()
+            if user['status'] != 'DEPROVISIONED':
+                user['status'] = 'DEPROVISIONED'
+                user['lastUpdated'] = timestamp(datetime.now(timezone.utc))
+            else:
+                org.users.remove(user)
+                del org.users_by_id[user_id]
+        return 204, None, {}
+
+    def reply(self, bucket, status, body, headers):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+        self.fake.record(bucket, len(data), status == 429)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic Okta org on localhost.")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--apps', type=int, default=50)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help="rate limit window in seconds")
+    parser.add_argument('--no-rate-limits', action='store_true')
+    args = parser.parse_args()
+
+    org = SyntheticOrg(args.users, args.apps, args.groups, args.seed)
+    fake = FakeOkta(org, args.port, args.latency, {} if args.no_rate_limits else None, args.window)
+    print(f"Fake Okta org with {args.users} users and {args.apps} apps at {fake.url}")
+    print("Set OKTA_ORG_URL to that address; any OKTA_API_KEY is accepted. Ctrl-C to stop")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,114 @@
 #!/usr/bin/env python3
 import csv
 from pathlib import Path
-import requests
 import json
 import time
 import collections
 import sys
 import os
 from dotenv import load_dotenv
-
-
-def get_paginated_data(url, token):
-    """Fetches paginated data from Okta API with rate limit handling."""
-    items = []
-    headers = {'Accept': 'application/json', 'Authorization': f'SSWS {token}'}
-    while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-
-        rate_limit_remaining = int(response.headers.get('x-rate-limit-remaining', 1))
-        if rate_limit_remaining <= 1:
-            reset_time = int(response.headers.get('x-rate-limit-reset', time.time() + 60))
-            sleep_duration = max(reset_time - time.time() + 1, 0)
-            print(f"Rate limit approaching. Sleeping {sleep_duration} seconds")
-            time.sleep(sleep_duration)
-
-        items.extend(response.json())
-
-        link_header = response.headers.get('link', '')
-        next_url = None
-        for link in link_header.split(','):
-            if 'rel="next"' in link:
-                next_url = link.split(';')[0].strip(' <>')
-        url = next_url
-    return items
-
-def get_user_report(url, token) :
-    users = get_paginated_data(f"{url}/api/v1/users", token)
-    return_list = []
-    for user in users:
-        print(user)
-        if user.get("profile", {}).get("userType", "") in ["Full Time", "Contractor - 1099", "Contractor", "Intern"]:
-            profile= {}
-            profile["login"] = user["profile"]["login"]
-            profile["user type"] = user["profile"]["userType"]
-            factors = get_paginated_data(f"{url}/api/v1/users/{user["id"]}/factors", token)
-
-            fastpass = {}
-            fastpass["desktop"] = []
-            fastpass["mobile"] = []
-
-            for factor in factors : 
-                if factor["factorType"] == "signed_nonce" :
-                    if factor["profile"]["platform"] in ["WINDOWS", "MACOS"] :
-                        print("\n\ndesktop\n")
-                        print(factor["profile"]["platform"])
-                        print(factor)
-                        fastpass["desktop"].append(factor["profile"]["name"])
-                    if factor["profile"]["platform"] in ["IOS", "ANDROID"]:
-                        print("\n\nmobile\n")
-                        print(factor["profile"]["platform"])
-                        print(factor)
-                        fastpass["mobile"].append(factor["profile"]["name"])
-
-            profile["mobile enrollments"] = ", ".join(fastpass["mobile"])
-            profile["desktop enrollments"] = ", ".join(fastpass["desktop"])
-
-            return_list.append(profile)
-    return return_list
+from checkpoint import Checkpoint
+from factor_inventory import open_inventory
+from metrics import verbose
+from okta_client import create_client
+from user_cache import iter_org_users
+from user_query import UserQuery
+
+VALID_USER_TYPES = ["Full Time", "Contractor - 1099", "Contractor", "Intern"]
+USER_QUERY = UserQuery(user_types=VALID_USER_TYPES, exclude_statuses=["DEPROVISIONED"], fields=("login", "userType"))
+# Parallel factor lookups; keep this below the org's /users/*/factors rate limit
+DEFAULT_WORKERS = 8
+# Factor lookups queued ahead of the CSV writer, per worker
+QUEUED_PER_WORKER = 4
+
+
+def factors_endpoint(user):
+    return f"/api/v1/users/{user['id']}/factors"
+
+def summarise_fastpass(user, factors):
+    """Report row listing the FastPass desktop and mobile devices among a user's factors."""
+    profile= {}
+    profile["login"] = user["profile"]["login"]
+    profile["user type"] = user["profile"]["userType"]
+
+    fastpass = {}
+    fastpass["desktop"] = []
+    fastpass["mobile"] = []
+
+    for factor in factors : 
+        if factor["factorType"] == "signed_nonce" :
+            if factor["profile"]["platform"] in ["WINDOWS", "MACOS"] :
+                if verbose():
+                    print(f"desktop {factor['profile']['platform']}: {factor}")
+                fastpass["desktop"].append(factor["profile"]["name"])
+            if factor["profile"]["platform"] in ["IOS", "ANDROID"]:
+                if verbose():
+                    print(f"mobile {factor['profile']['platform']}: {factor}")
+                fastpass["mobile"].append(factor["profile"]["name"])
+
+    profile["mobile enrollments"] = ", ".join(fastpass["mobile"])
+    profile["desktop enrollments"] = ", ".join(fastpass["desktop"])
+    return profile
+
+def iter_user_factors(client, max_workers=DEFAULT_WORKERS, inventory=None, query=USER_QUERY, skip=None):
+    """Yield (user, factors) for every user matching query, in listing order.
+
+    Factor lookups run in parallel on the client (threads or coroutines,
+    see create_client) but results come back in listing order. Only a
+    bounded number of lookups are queued at once, so memory stays flat
+    regardless of org size. With a FactorInventory, only users whose
+    factors may have changed are fetched. factors is None for users that
+    skip(user) is true for.
+    """
+    def finish(user, future, factors):
+        if future is not None:
+            factors = future.result()
+            if inventory is not None:
+                inventory.save(user, factors)
+        return user, factors
+
+    pending = collections.deque()
+    for user in iter_org_users(client, query):
+        if verbose():
+            print(user)
+        future = factors = None
+        if skip is None or not skip(user):
+            if inventory is not None and not inventory.needs_refresh(user):
+                factors = inventory.get(user['id'])
+            else:
+                future = client.submit_paginated(factors_endpoint(user))
+        pending.append((user, future, factors))
+        if len(pending) >= max_workers * QUEUED_PER_WORKER:
+            yield finish(*pending.popleft())
+    while pending:
+        yield finish(*pending.popleft())
+
+def iter_user_report(client, max_workers=DEFAULT_WORKERS, checkpoint=None, inventory=None):
+    """Yield one report row per qualifying user, in listing order.
+
+    With a checkpoint, every finished row is saved and users already in it
+    are not fetched again, unless the inventory knows their factors changed.
+    """
+    def resumed(user):
+        if checkpoint is None or f"factors:{user['id']}" not in checkpoint:
+            return False
+        return inventory is None or inventory.keeps_resumed(user)
+
+    for user, factors in iter_user_factors(client, max_workers, inventory, skip=resumed):
+        key = f"factors:{user['id']}"
+        if factors is None:
+            yield checkpoint.get(key)
+            continue
+        row = summarise_fastpass(user, factors)
+        if checkpoint is not None:
+            checkpoint.save(key, row)
+        yield row
 
 def write_csv(data, output_path):
-    """Write list of dictionaries to CSV file."""
-    if not data:
+    """Write dictionaries to CSV file as they are produced."""
+    records = iter(data)
+    first = next(records, None)
+    if first is None:
         print("No data to export!")
         return
 
@@ -80,13 +116,14 @@ def write_csv(data, output_path):
     output_dir = os.path.dirname(output_path)
     os.makedirs(output_dir, exist_ok=True)
 
-    fieldnames = list(data[0].keys())
+    fieldnames = list(first.keys())
     
     try:
         with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
             writer.writeheader()
-            for record in data:
+            writer.writerow(first)
+            for record in records:
                 writer.writerow(record)
         print(f"Successfully exported to {output_path}")
     except PermissionError:
@@ -98,6 +135,22 @@ def write_csv(data, output_path):
 
 
 
+def write_report(client, output_path, max_workers=DEFAULT_WORKERS, resume=False):
+    """Write the FastPass report to output_path; resume reuses a failed run's factor lookups."""
+    checkpoint = Checkpoint("fastpass", resume=resume)
+    # Factors of users that did not change since the last run come from disk
+    inventory = open_inventory(client, 'fastpass')
+    try:
+        # Rows are written as their factor lookups finish
+        write_csv(iter_user_report(client, max_workers, checkpoint, inventory), output_path)
+    except Exception:
+        if inventory is not None:
+            inventory.close()
+        raise
+    if inventory is not None:
+        inventory.finish()
+    checkpoint.finish()
+
 def main():
     """Main function to execute the script."""
     # Load environment variables from .env file
@@ -114,12 +167,14 @@ def main():
         sys.exit(1)
     
     created_file_name = input("Created file name: ")
-    report = get_user_report(OKTA_ORG_URL, OKTA_API_KEY)
+    max_workers = int(os.getenv('FASTPASS_WORKERS', DEFAULT_WORKERS))
 
     # Get the user's Documents directory
     documents_dir = os.path.expanduser("~/Documents")
     output_path = os.path.join(documents_dir, f"{created_file_name}.csv")
-    write_csv(report, output_path)
+    with create_client(OKTA_ORG_URL, OKTA_API_KEY, workers=max_workers) as client:
+        # --resume reuses the factor lookups a failed run already finished
+        write_report(client, output_path, max_workers, resume="--resume" in sys.argv[1:])
     
 
 if __name__ == "__main__":
@@ -5,70 +5,46 @@ import csv
 from pathlib import Path
 import requests
 import json
-import time
 import collections
 import os
 from dotenv import load_dotenv
+from okta_client import OktaClient
+from bulk_lifecycle import DEFAULT_JOURNAL_PATH, DEFAULT_WORKERS, Journal, deprovision_users, print_plan
+from user_cache import cache_path, iter_org_users, synced_cache
+from user_query import UserQuery
 
 
-
-def okta_api(endpoint):
-    items = []
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'SSWS {OKTA_API_KEY}',
-    }
-    url  = OKTA_ORG_URL+endpoint
-    while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        
-        rate_limit_remaining = int(response.headers.get('x-rate-limit-remaining', 1))
-        if rate_limit_remaining <= 1:
-            current_time = int(time.time())
-            reset_time = int(response.headers.get('x-rate-limit-reset', current_time + 60))
-            sleep_duration = reset_time - current_time + 1
-            sleep_duration = max(sleep_duration, 0)
-            print(f"Rate limit approaching. Sleeping {sleep_duration} seconds")
-            time.sleep(sleep_duration)
-
-        items.extend(json.loads(response.text))
-
-        link_header = response.headers.get('link', '')
-        next_url = None
-        for link in link_header.split(','):
-            if 'rel="next"' in link:
-                next_url = link.split(';')[0].strip(' <>')
-        url = next_url
-    
-    return items
-
-def delete_users():
+def delete_users(client, dry_run=False, max_workers=DEFAULT_WORKERS, journal_path=DEFAULT_JOURNAL_PATH, confirmed=False):
     profile = "profile"
     department = "department"
     id = "id"
     login = "login"
 
-
-
-    users = okta_api("/api/v1/users?limit=200")
-    for user in users :
-        user_profile = user[profile]
-        dept = user_profile.get(department, "N/A")
-        if dept != "IT" :
-            print(user[profile][login])
-            
-            headers = {
-                'Accept': 'application/json',
-                'Authorization': f'SSWS {OKTA_API_KEY}',
-            }
-            payload = {}
-            url = f"{OKTA_ORG_URL}/api/v1/users/{user[id]}?sendEmail=false"
-            print(url)
-            response = requests.request("DELETE", url, headers=headers, data=payload)
-            print(response.text)
-            response = requests.request("DELETE", url, headers=headers, data=payload)
+    # Like the plain /users listing, leave out users that were already DEPROVISIONED
+    users = list(iter_org_users(client, UserQuery(exclude_statuses=["DEPROVISIONED"], fields=(login, department))))
+
+    with Journal(journal_path) as journal:
+        if journal.done:
+            # A resumed run still has to delete the users it deactivated itself
+            deactivated = UserQuery(statuses=["DEPROVISIONED"], fields=(login, department))
+            users += [user for user in iter_org_users(client, deactivated) if journal.is_done(user[id], "deactivate")]
+        targets = [user for user in users if user[profile].get(department, "N/A") != "IT"]
+        total_calls = print_plan(targets, journal)
+        if dry_run or not total_calls:
+            return
+        if not confirmed:
+            confirm = input(f"Type DELETE to remove {len(targets)} users from {client.org_url}: ")
+            if confirm.strip() != "DELETE":
+                print("Aborted")
+                return
+        try:
+            _, failed = deprovision_users(client, targets, journal, max_workers)
+            if not failed:
+                journal.finish()
+        finally:
+            # Deleted users never come back in an incremental sync
+            if cache_path() != 'off':
+                synced_cache(client).remove([user[id] for user in targets if journal.is_done(user[id], "delete")])
 
 
 if __name__ == "__main__":
@@ -79,4 +55,7 @@ if __name__ == "__main__":
     
     if not OKTA_ORG_URL or not OKTA_API_KEY:
         raise ValueError("Missing required environment variables. Please check your .env file.")
-    delete_users()
+    dry_run = os.getenv('WIPE_DRY_RUN') == '1'
+    max_workers = int(os.getenv('WIPE_WORKERS', DEFAULT_WORKERS))
+    with OktaClient(OKTA_ORG_URL, OKTA_API_KEY, pool_size=max_workers) as client:
+        delete_users(client, dry_run, max_workers, os.getenv('WIPE_JOURNAL', DEFAULT_JOURNAL_PATH))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Lookup keys used to match rows exported from other systems to Okta users.
+
+UserCache persists these keys next to the users they point at and keeps
+them current on every sync. MatchIndex builds the same keys in memory for
+runs that do not use the cache.
+
+Fuzzy name matching never compares a row against the whole org. Users are
+also indexed under coarse blocking keys (the Soundex code of each surname
+part plus the initial of the canonical first name), so a row is only
+scored against the handful of users sharing one of its keys.
+"""
+import functools
+import re
+import unicodedata
+
+
+# Profile attributes that identify a user by address, most trusted first
+EMAIL_KINDS = ('email', 'secondEmail', 'login')
+
+# Common nicknames mapped to the name they are short for
+NICKNAMES = {
+    'al': 'albert', 'alex': 'alexander', 'andy': 'andrew', 'bill': 'william',
+    'billy': 'william', 'bob': 'robert', 'bobby': 'robert', 'rob': 'robert',
+    'chris': 'christopher', 'dan': 'daniel', 'danny': 'daniel', 'dave': 'david',
+    'ed': 'edward', 'eddie': 'edward', 'jim': 'james', 'jimmy': 'james',
+    'joe': 'joseph', 'jon': 'jonathan', 'kate': 'katherine', 'katie': 'katherine',
+    'kathy': 'katherine', 'liz': 'elizabeth', 'beth': 'elizabeth', 'matt': 'matthew',
+    'mike': 'michael', 'nick': 'nicholas', 'pat': 'patricia', 'peggy': 'margaret',
+    'maggie': 'margaret', 'rick': 'richard', 'dick': 'richard', 'rich': 'richard',
+    'sam': 'samuel', 'steve': 'steven', 'sue': 'susan', 'ted': 'edward',
+    'tom': 'thomas', 'tony': 'anthony', 'will': 'william', 'jen': 'jennifer',
+    'jenny': 'jennifer', 'greg': 'gregory', 'jeff': 'jeffrey', 'ben': 'benjamin',
+}
+
+SOUNDEX_CODES = {char: str(code) for code, chars in enumerate(
+    ['aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for char in chars}
+
+
+def normalize_name(value):
+    """Lowercase, strip accents and collapse whitespace in a name."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.lower().split())
+
+
+def name_key(first, last):
+    """Key for an exact (first, last) lookup, or None if either part is missing."""
+    first, last = (first or '').lower(), (last or '').lower()
+    if first and last:
+        return f"{first}\t{last}"
+    return None
+
+
+def name_parts(value):
+    """Normalised pieces of a name, splitting hyphenated and multi-word names."""
+    return [part for part in re.split(r"[\s\-'.]+", normalize_name(value)) if part]
+
+
+def canonical_first_name(value):
+    """First word of a given name with nicknames expanded; drops middle initials."""
+    parts = name_parts(value)
+    if not parts:
+        return ''
+    return NICKNAMES.get(parts[0], parts[0])
+
+
+def soundex(word):
+    """Four character Soundex code of a word."""
+    word = ''.join(char for char in word.lower() if char.isalpha())
+    if not word:
+        return ''
+    code = word[0].upper()
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit not in ('', '0') and digit != previous:
+            code += digit
+        if char not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def block_keys(first, last):
+    """Coarse keys that any plausible fuzzy match of this name shares."""
+    first_name = canonical_first_name(first)
+    parts = name_parts(last)
+    if not first_name or not parts:
+        return set()
+    surnames = set(parts) | {''.join(parts)}
+    return {f"{soundex(surname)}\t{first_name[0]}" for surname in surnames}
+
+
+def jaro_winkler(a, b):
+    """Jaro-Winkler similarity between two strings, from 0 to 1."""
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(max(len(a), len(b)) // 2 - 1, 0)
+    a_matched = [False] * len(a)
+    b_matched = [False] * len(b)
+    matches = 0
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == char:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    a_chars = [char for char, matched in zip(a, a_matched) if matched]
+    b_chars = [char for char, matched in zip(b, b_matched) if matched]
+    transpositions = sum(x != y for x, y in zip(a_chars, b_chars)) / 2
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions) / matches) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * 0.1 * (1 - jaro)
+
+
+@functools.lru_cache(maxsize=65536)
+def name_features(first, last):
+    """What feature_similarity compares of a name, worked out once per distinct name."""
+    parts = tuple(name_parts(last))
+    return canonical_first_name(first), parts, ''.join(parts)
+
+
+def score_names(first, last, names):
+    """Similarity of (first, last) to each (first, last) pair in names, from 0 to 1.
+
+    A block holds many users with the same name, so each distinct name is
+    scored once and the scores are spread back over the list.
+    """
+    row = name_features(first, last)
+    scores = {name: feature_similarity(row, name_features(*name)) for name in dict.fromkeys(names)}
+    return list(map(scores.__getitem__, names))
+
+
+def feature_similarity(a, b):
+    """Score how likely two names, as name_features, belong to the same person."""
+    given_a, parts_a, joined_a = a
+    given_b, parts_b, joined_b = b
+    last_score = max(
+        [jaro_winkler(joined_a, joined_b)]
+        + [jaro_winkler(x, y) for x in parts_a for y in parts_b]
+    )
+    if given_a == given_b:
+        first_score = 1.0
+    elif min(len(given_a), len(given_b)) == 1 and given_a[:1] == given_b[:1]:
+        # Only an initial was given
+        first_score = 0.9
+    else:
+        first_score = jaro_winkler(given_a, given_b)
+    return round(0.6 * last_score + 0.4 * first_score, 2)
+
+
+def index_keys(user):
+    """Yield the (kind, key) pairs a user can be found under."""
+    profile = user.get('profile', {})
+    for kind in EMAIL_KINDS:
+        value = profile.get(kind)
+        if value:
+            yield kind, value.lower()
+    first, last = profile.get('firstName'), profile.get('lastName')
+    key = name_key(first, last)
+    if key:
+        yield 'name', key
+    key = name_key(normalize_name(first), normalize_name(last))
+    if key:
+        yield 'normalized_name', key
+    for key in block_keys(first, last):
+        yield 'name_block', key
+
+
+class MatchIndex:
+    """In-memory index offering the same lookups as UserCache."""
+
+    def __init__(self, users):
+        self.entries = {}
+        self.total = 0
+        for user in users:
+            self.total += 1
+            for key in index_keys(user):
+                self.entries.setdefault(key, []).append(user)
+
+    def count(self):
+        return self.total
+
+    def lookup(self, kind, key, query=None):
+        """Users stored under key that match query, in the order they were indexed."""
+        users = self.entries.get((kind, key), [])
+        return [query.project(user) for user in users if query.matches(user)] if query else list(users)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Request metrics for a run, collected by the Okta clients.
+
+Every request is recorded against its rate limit bucket (see
+rate_governor.bucket_for): latency histogram, status codes, bytes,
+pages, retries, time spent sleeping for rate limits and retries, and how
+many requests were in flight at once. When the client closes, a summary
+is printed. Set OKTA_METRICS_JSON and/or OKTA_METRICS_PROM to a file path
+to also export the numbers as JSON or Prometheus text.
+
+Per-request logging ("Fetching: <url>" and similar) is off unless
+OKTA_VERBOSE=1.
+"""
+import json
+import os
+import threading
+import time
+from rate_governor import bucket_for
+
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+
+def verbose():
+    """True when OKTA_VERBOSE=1 asks for per-request and per-record logging."""
+    return os.getenv('OKTA_VERBOSE') == '1'
+
+
+class EndpointStats:
+    """Counters for one endpoint family."""
+
+    def __init__(self):
+        self.requests = 0
+        self.pages = 0
+        self.reused = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.rate_limit_sleep = 0.0
+        self.retry_sleep = 0.0
+        self.statuses = {}
+        self.histogram = [0] * len(LATENCY_BUCKETS)
+
+    def observe(self, seconds):
+        self.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.histogram[i] += 1
+                return
+
+    def quantile(self, q):
+        """Upper bound of the histogram bucket holding the q-th latency."""
+        rank = q * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.histogram):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return None
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'pages': self.pages,
+            'reused': self.reused,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'seconds': round(self.seconds, 3),
+            'rate_limit_sleep_seconds': round(self.rate_limit_sleep, 3),
+            'retry_sleep_seconds': round(self.retry_sleep, 3),
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            'latency_histogram': {str(bound): count for bound, count in zip(LATENCY_BUCKETS, self.histogram)},
+        }
+
+
+class RunMetrics:
+    """Thread-safe request metrics shared by everything using one client."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.endpoints = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def stats(self, url):
+        name = bucket_for(url)
+        if name not in self.endpoints:
+            self.endpoints[name] = EndpointStats()
+        return self.endpoints[name]
+
+    def start(self):
+        """A request is about to go out; returns the time to pass to finish."""
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def finish(self, url, started, status=None, size=0):
+        """A request came back (status None if it failed without a response)."""
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.in_flight -= 1
+            stats = self.stats(url)
+            stats.requests += 1
+            stats.bytes += size
+            stats.observe(elapsed)
+            status = status or 'error'
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def page(self, url):
+        with self.lock:
+            self.stats(url).pages += 1
+
+    def reuse(self, url):
+        """A collection fetch was answered by one already in flight or remembered."""
+        with self.lock:
+            self.stats(url).reused += 1
+
+    def rate_limit_sleep(self, url, seconds):
+        if seconds:
+            with self.lock:
+                self.stats(url).rate_limit_sleep += seconds
+
+    def retry(self, url, seconds):
+        with self.lock:
+            stats = self.stats(url)
+            stats.retries += 1
+            stats.retry_sleep += seconds
+
+    def total_requests(self):
+        with self.lock:
+            return sum(stats.requests for stats in self.endpoints.values())
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'wall_seconds': round(time.time() - self.started, 3),
+                'peak_in_flight': self.peak_in_flight,
+                'endpoints': {name: stats.as_dict() for name, stats in sorted(self.endpoints.items())},
+            }
+
+    def summary(self):
+        """Table of where the run's time went, one line per endpoint family."""
+        lines = [f"API usage over {time.time() - self.started:.1f}s, {self.total_requests()} requests, "
+                 f"up to {self.peak_in_flight} in flight:",
+                 f"  {'endpoint':<26}{'requests':>9}{'pages':>7}{'reused':>8}{'retries':>8}{'p50':>7}{'p95':>7}"
+                 f"{'busy s':>9}{'limit wait s':>13}{'MB':>8}"]
+        with self.lock:
+            for name, stats in sorted(self.endpoints.items(), key=lambda item: -item[1].seconds):
+                p50, p95 = stats.quantile(0.5), stats.quantile(0.95)
+                lines.append(
+                    f"  {name:<26}{stats.requests:>9}{stats.pages:>7}{stats.reused:>8}{stats.retries:>8}"
+                    f"{format_bound(p50):>7}{format_bound(p95):>7}{stats.seconds:>9.1f}"
+                    f"{stats.rate_limit_sleep + stats.retry_sleep:>13.1f}{stats.bytes / 1e6:>8.1f}")
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """The metrics in Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP okta_{name} {help_text}")
+            lines.append(f"# TYPE okta_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"okta_{name}{{{label_text}}} {value}" if label_text else f"okta_{name} {value}")
+
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            metric('requests_total', 'counter', "Requests sent, by endpoint family and status.",
+                   [({'endpoint': name, 'status': status}, count)
+                    for name, stats in endpoints for status, count in sorted(stats.statuses.items(), key=str)])
+            metric('pages_total', 'counter', "Collection pages fetched.",
+                   [({'endpoint': name}, stats.pages) for name, stats in endpoints])
+            metric('reused_total', 'counter', "Collection fetches answered from memory instead of Okta.",
+                   [({'endpoint': name}, stats.reused) for name, stats in endpoints])
+            metric('retries_total', 'counter', "Requests retried after a 429 or 5xx.",
+                   [({'endpoint': name}, stats.retries) for name, stats in endpoints])
+            metric('response_bytes_total', 'counter', "Response body bytes received.",
+                   [({'endpoint': name}, stats.bytes) for name, stats in endpoints])
+            metric('rate_limit_sleep_seconds_total', 'counter', "Time spent waiting on the rate governor.",
+                   [({'endpoint': name}, round(stats.rate_limit_sleep, 3)) for name, stats in endpoints])
+            metric('retry_sleep_seconds_total', 'counter', "Time spent backing off before retries.",
+                   [({'endpoint': name}, round(stats.retry_sleep, 3)) for name, stats in endpoints])
+            lines.append("# HELP okta_request_duration_seconds Request latency.")
+            lines.append("# TYPE okta_request_duration_seconds histogram")
+            for name, stats in endpoints:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.histogram):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else bound
+                    lines.append(f'okta_request_duration_seconds_bucket{{endpoint="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'okta_request_duration_seconds_sum{{endpoint="{name}"}} {stats.seconds:.3f}')
+                lines.append(f'okta_request_duration_seconds_count{{endpoint="{name}"}} {stats.requests}')
+            metric('peak_in_flight', 'gauge', "Most requests in flight at once.", [({}, self.peak_in_flight)])
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Print the summary and write any exports asked for in the environment."""
+        if not self.endpoints:
+            return
+        print(self.summary())
+        json_path = os.getenv('OKTA_METRICS_JSON')
+        if json_path:
+            with open(json_path, 'w', encoding='utf-8') as f:
+                json.dump(self.as_dict(), f, indent=2)
+            print(f"Metrics written to {json_path}")
+        prometheus_path = os.getenv('OKTA_METRICS_PROM')
+        if prometheus_path:
+            with open(prometheus_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus())
+            print(f"Metrics written to {prometheus_path}")
+
+
+def format_bound(bound):
+    if bound is None:
+        return '-'
+    return '>10s' if bound == float('inf') else f"{bound:g}s"
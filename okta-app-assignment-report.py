@@ -3,102 +3,237 @@ import csv
 from pathlib import Path
 import requests
 import json
-import time
 import collections
 import os
+import sys
 from dotenv import load_dotenv
+from concurrent.futures import as_completed
+from assignment_matrix import AssignmentMatrix, WRITERS, load_pyarrow
+from checkpoint import Checkpoint
+from okta_client import create_client
+from user_cache import iter_org_users
+from user_query import UserQuery
 
 
-load_dotenv()
+DEFAULT_REPORT_LOCATION = os.path.expanduser("~/Documents/Applications_report")
+VALID_USER_TYPES = ["Full Time", "Contractor", "Intern", "Contractor-1099"]
+USER_QUERY = UserQuery(
+    statuses=["ACTIVE"],
+    user_types=VALID_USER_TYPES,
+    fields=("firstName", "lastName", "email", "userType", "title", "department", "manager", "organization")
+)
+# Report column and the profile attribute it is read from
+USER_COLUMNS = [
+    ("First Name", "firstName"),
+    ("Last Name", "lastName"),
+    ("Email", "email"),
+    ("User Type", "userType"),
+    ("Title", "title"),
+    ("Department", "department"),
+    ("Manager", "manager"),
+    ("Organization", "organization"),
+]
+# Apps crawled at once; all workers share one client and its rate limit pause
+DEFAULT_WORKERS = 8
+# Largest page Okta serves for /apps/{id}/users and for /apps?filter=user.id
+APP_USERS_PAGE_SIZE = 500
+USER_APPS_PAGE_SIZE = 200
+# Assumed assignments per user when estimating how many pages a crawl needs
+ESTIMATED_APPS_PER_USER = 10
+# Rate limit bucket each strategy spends its requests in
+STRATEGY_BUCKETS = {
+    'apps': '/api/v1/apps/*/users',
+    'users': '/api/v1/apps',
+}
+
+
+def item_id(item):
+    """Keep only an item's id; one shared function so repeat crawls can be answered from memory."""
+    return item.get("id")
+
+
+def mark_app(matrix, apps_dict, app_id, user_ids, assignments=None):
+    """Mark an app's users in the matrix and, if given, in assignments (user id -> app ids)."""
+    matrix.mark(apps_dict[app_id], user_ids)
+    if assignments is not None:
+        for user_id in user_ids:
+            if user_id in matrix.user_index:
+                assignments.setdefault(user_id, []).append(app_id)
+
 
-OKTA_ORG_URL = os.getenv('OKTA_ORG_URL')
-OKTA_API_KEY = os.getenv('OKTA_API_KEY')
+def mark_user(matrix, apps_dict, user_id, app_ids, assignments=None):
+    """Mark a user's apps in the matrix and, if given, in assignments; apps outside apps_dict are ignored."""
+    app_ids = [app_id for app_id in app_ids if app_id in apps_dict]
+    matrix.mark_user(user_id, [apps_dict[app_id] for app_id in app_ids])
+    if assignments is not None and user_id in matrix.user_index:
+        assignments.setdefault(user_id, []).extend(app_ids)
 
-if not OKTA_ORG_URL or not OKTA_API_KEY:
-    raise ValueError("Missing required environment variables. Please check your .env file.")
 
-csv_location = os.path.expanduser("~/Documents/Applications_report.csv")
-valid_user_types = ["Full Time", "Contractor", "Intern", "Contractor-1099"]
+def crawl_app_assignments(client, apps_dict, matrix, checkpoint=None, assignments=None):
+    """Crawl every app's user list in parallel and mark assignments.
 
-def get_paginated_data(url):
-    items = []
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f'SSWS {OKTA_API_KEY}',
+    Crawls run on the client (threads or coroutines); results are merged
+    here on the calling thread so the matrix is never written
+    concurrently. Apps already saved in the checkpoint are merged from it
+    instead of being crawled again.
+    """
+    to_crawl = {}
+    for app_id, app_name in apps_dict.items():
+        if checkpoint is not None and f"app:{app_id}" in checkpoint:
+            mark_app(matrix, apps_dict, app_id, checkpoint.get(f"app:{app_id}"), assignments)
+        else:
+            to_crawl[app_id] = app_name
+
+    # Keep only ids so a large app's membership stays cheap to hold
+    futures = {
+        client.submit_paginated(f"/api/v1/apps/{app_id}/users", params={'limit': APP_USERS_PAGE_SIZE},
+                                pick=item_id): app_id
+        for app_id in to_crawl
     }
-    while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        
-        rate_limit_remaining = int(response.headers.get('x-rate-limit-remaining', 1))
-        if rate_limit_remaining <= 1:
-            current_time = int(time.time())
-            reset_time = int(response.headers.get('x-rate-limit-reset', current_time + 60))
-            sleep_duration = reset_time - current_time + 1
-            sleep_duration = max(sleep_duration, 0)
-            print(f"Rate limit approaching. Sleeping {sleep_duration} seconds")
-            time.sleep(sleep_duration)
-
-        items.extend(json.loads(response.text))
-
-        link_header = response.headers.get('link', '')
-        next_url = None
-        for link in link_header.split(','):
-            if 'rel="next"' in link:
-                next_url = link.split(';')[0].strip(' <>')
-        url = next_url
-    
-    return items
-
-users = get_paginated_data(f"{OKTA_ORG_URL}/api/v1/users?limit=200&search=status eq \"ACTIVE\"")
-
-apps = get_paginated_data(f"{OKTA_ORG_URL}/api/v1/apps?filter=status eq \"ACTIVE\"")
-
-apps_dict = {app["id"]: app["label"] for app in apps}
-apps_dict = collections.OrderedDict(
-    sorted(apps_dict.items(), key=lambda item: item[1])
-)
+    for future in as_completed(futures):
+        app_id = futures[future]
+        user_ids = future.result()
+        if checkpoint is not None:
+            checkpoint.save(f"app:{app_id}", user_ids)
+        mark_app(matrix, apps_dict, app_id, user_ids, assignments)
+
+
+def crawl_user_assignments(client, apps_dict, matrix, checkpoint=None, assignments=None):
+    """Ask Okta for each report user's apps and mark assignments.
+
+    Produces the same matrix as crawl_app_assignments from the other side:
+    apps?filter=user.id lists direct and group assignments alike. Apps
+    outside apps_dict (inactive ones) are ignored.
+    """
+    to_crawl = []
+    for user_id in matrix.user_ids:
+        if checkpoint is not None and f"user:{user_id}" in checkpoint:
+            mark_user(matrix, apps_dict, user_id, checkpoint.get(f"user:{user_id}"), assignments)
+        else:
+            to_crawl.append(user_id)
 
-user_records = {}
-
-for user in users:
-    profile = user.get("profile", {})
-    user_type = profile.get("userType", "N/A")
-    
-    if user_type not in valid_user_types:
-        continue
-    
-    user_record = {
-        "First Name": profile.get("firstName", "N/A"),
-        "Last Name": profile.get("lastName", "N/A"),
-        "Email": profile.get("email", "N/A"),
-        "User Type": user_type,
-        "Title": profile.get("title", "N/A"),
-        "Department": profile.get("department", "N/A"),
-        "Manager": profile.get("manager", "N/A"),
-        "Organization": profile.get("organization", "N/A")
+    futures = {
+        client.submit_paginated("/api/v1/apps", params={'filter': f'user.id eq "{user_id}"', 'limit': USER_APPS_PAGE_SIZE},
+                                pick=item_id): user_id
+        for user_id in to_crawl
     }
-    
-    for app_name in apps_dict.values():
-        user_record[app_name] = ""
-    
-    user_records[user["id"]] = user_record
-
-for app_id, app_name in apps_dict.items():
-    app_users = get_paginated_data(f"{OKTA_ORG_URL}/api/v1/apps/{app_id}/users")
-    
-    for app_user in app_users:
-        user_id = app_user.get("id")
-        if user_id not in user_records:
-            continue       
-        user_records[user_id][app_name] = "assigned"
-
-with open(csv_location, 'w', newline='') as csvfile:
-    fieldnames = list(next(iter(user_records.values())).keys())
-    
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-    for record in user_records.values():
-        writer.writerow(record)
-print(f"Report generated at {csv_location}")
\ No newline at end of file
+    for future in as_completed(futures):
+        user_id = futures[future]
+        app_ids = future.result()
+        if checkpoint is not None:
+            checkpoint.save(f"user:{user_id}", app_ids)
+        mark_user(matrix, apps_dict, user_id, app_ids, assignments)
+
+
+def estimate_requests(app_count, user_count):
+    """Rough request count of each crawl strategy: one page per app or user plus overflow pages."""
+    assignments = user_count * ESTIMATED_APPS_PER_USER
+    return {
+        'apps': app_count + assignments // APP_USERS_PAGE_SIZE,
+        'users': user_count + assignments // USER_APPS_PAGE_SIZE,
+    }
+
+
+def choose_strategy(app_count, user_count, requested='auto', limits=None):
+    """Crawl strategy to run; auto picks the one estimated to finish first.
+
+    limits maps each strategy to the rate limit of the bucket it spends its
+    requests in (see STRATEGY_BUCKETS); a strategy's time is its request
+    count divided by that limit. Without limits, fewer requests wins.
+    """
+    if requested in STRATEGIES:
+        return requested
+    if requested != 'auto':
+        raise ValueError(f"Unknown APP_REPORT_STRATEGY {requested!r}; use auto, {', '.join(STRATEGIES)}")
+    estimates = estimate_requests(app_count, user_count)
+    limits = limits or {name: 1 for name in estimates}
+    chosen = min(estimates, key=lambda name: estimates[name] / limits[name])
+    print(f"Estimated requests: {estimates['apps']} crawling apps (limit {limits['apps']}),"
+          f" {estimates['users']} crawling users (limit {limits['users']}); crawling {chosen}")
+    return chosen
+
+
+STRATEGIES = {
+    'apps': crawl_app_assignments,
+    'users': crawl_user_assignments,
+}
+
+
+
+def parse_formats(value):
+    """Output formats from a comma separated list such as "csv,long"."""
+    output_formats = [name.strip() for name in value.split(',') if name.strip()]
+    for output_format in output_formats:
+        if output_format not in WRITERS:
+            raise ValueError(f"Unknown report format {output_format!r}; use {', '.join(WRITERS)}")
+    if 'parquet' in output_formats:
+        # Fail before the crawl rather than after it
+        load_pyarrow()
+    return output_formats
+
+
+def crawl_matrix(client, strategy='auto', checkpoint=None, assignments=None):
+    """The org's active apps (id -> label) and the AssignmentMatrix of the report's users.
+
+    Apps sharing a label share a matrix column; pass a dict as assignments
+    to also collect each report user's app ids.
+    """
+    apps = client.get_paginated_data("/api/v1/apps", params={'filter': 'status eq "ACTIVE"'}, shared=True)
+
+    apps_dict = {app["id"]: app["label"] for app in apps}
+    apps_dict = collections.OrderedDict(
+        sorted(apps_dict.items(), key=lambda item: item[1])
+    )
+
+    matrix = AssignmentMatrix([column for column, _ in USER_COLUMNS], apps_dict.values())
+
+    # Only the report's users and columns are read, one user at a time
+    users = iter_org_users(client, USER_QUERY)
+
+    for user in users:
+        profile = user.get("profile", {})
+        matrix.add_user(user["id"], [profile.get(attribute, "N/A") for _, attribute in USER_COLUMNS])
+
+    limits = {name: client.governor.limit(bucket) for name, bucket in STRATEGY_BUCKETS.items()}
+    crawl = STRATEGIES[choose_strategy(len(apps_dict), len(matrix), strategy, limits)]
+    crawl(client, apps_dict, matrix, checkpoint, assignments)
+    return apps_dict, matrix
+
+
+def build_report(client, report_location=DEFAULT_REPORT_LOCATION, output_formats=('csv',), strategy='auto',
+                 resume=False):
+    """Crawl the org's app assignments and write the report in each of output_formats.
+
+    strategy is apps, users, or auto to pick the cheaper one. resume
+    reuses the crawls a failed run already finished.
+    """
+    checkpoint = Checkpoint("app-assignment-report", resume=resume)
+    _, matrix = crawl_matrix(client, strategy, checkpoint)
+
+    for output_format in output_formats:
+        suffix, write = WRITERS[output_format]
+        write(matrix, report_location + suffix)
+        print(f"Report generated at {report_location + suffix}")
+    checkpoint.finish()
+
+
+def main():
+    load_dotenv()
+
+    OKTA_ORG_URL = os.getenv('OKTA_ORG_URL')
+    OKTA_API_KEY = os.getenv('OKTA_API_KEY')
+
+    if not OKTA_ORG_URL or not OKTA_API_KEY:
+        raise ValueError("Missing required environment variables. Please check your .env file.")
+
+    # Comma separated: csv (one column per app), long (one row per assignment), parquet
+    output_formats = parse_formats(os.getenv('APP_REPORT_FORMATS', 'csv'))
+    max_workers = int(os.getenv('APP_REPORT_WORKERS', DEFAULT_WORKERS))
+    with create_client(OKTA_ORG_URL, OKTA_API_KEY, workers=max_workers) as client:
+        # --resume reuses the app crawls a failed run already finished
+        build_report(client, DEFAULT_REPORT_LOCATION, output_formats, os.getenv('APP_REPORT_STRATEGY', 'auto'),
+                     resume="--resume" in sys.argv[1:])
+
+
+if __name__ == "__main__":
+    main()
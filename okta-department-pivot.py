@@ -3,10 +3,12 @@ import requests
 import csv
 import json
 import os
-import time
 import sys
 from pathlib import Path
 from dotenv import load_dotenv
+from okta_client import OktaClient
+from user_cache import cache_path, synced_cache
+from user_query import UserQuery, quote
 
 def get_users(import_file):
     """Reads a CSV file and returns a list of dictionaries."""
@@ -15,6 +17,7 @@ def get_users(import_file):
 
 def pivot(user_list):
     """Creates a pivot table based on the user list."""
+    # One pass over the row dicts beats turning them into columns for aggregate.group_by first
     pivot_data = {}
     for user in user_list:
         department = user["Department"].lower()  # Normalize department name to lowercase
@@ -33,53 +36,67 @@ def pivot(user_list):
             dept_data["Inactive Count"] += 1
     return pivot_data
 
-def get_paginated_data(url, token):
-    """Fetches paginated data from Okta API with rate limit handling."""
-    items = []
-    headers = {'Accept': 'application/json', 'Authorization': f'SSWS {token}'}
-    while url:
-        print(f"Fetching: {url}")
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-
-        rate_limit_remaining = int(response.headers.get('x-rate-limit-remaining', 1))
-        if rate_limit_remaining <= 1:
-            reset_time = int(response.headers.get('x-rate-limit-reset', time.time() + 60))
-            sleep_duration = max(reset_time - time.time() + 1, 0)
-            print(f"Rate limit approaching. Sleeping {sleep_duration} seconds")
-            time.sleep(sleep_duration)
-
-        items.extend(response.json())
-
-        link_header = response.headers.get('link', '')
-        next_url = None
-        for link in link_header.split(','):
-            if 'rel="next"' in link:
-                next_url = link.split(';')[0].strip(' <>')
-        url = next_url
-    return items
-
-def okta_group_count(group_id, org_url, token):
+def okta_group_count(group_id, client):
     """Fetches the user count for a specific Okta group."""
-    url = f"{org_url}/api/v1/groups/{group_id}/users"
-    return len(get_paginated_data(url, token))
-
-def okta_group_search(pivot_data, org_url, token, prefix):
-    """Searches for Okta groups and updates the pivot data with user counts."""
+    return sum(len(page) for page in client.iter_pages(f"/api/v1/groups/{group_id}/users"))
+
+def okta_prefixed_groups(client, prefix):
+    """Lists every group whose name starts with prefix, with member counts where Okta provides them."""
+    params = {'search': f'profile.name sw {quote(prefix)}', 'expand': 'stats', 'limit': 200}
+    return client.get_paginated_data("/api/v1/groups", params=params, shared=True)
+
+def find_department_group(groups, department_name, prefix):
+    """Picks the group named <prefix><department>, else the first prefixed group mentioning the department."""
+    candidates = [group for group in groups
+                  if department_name in group.get("profile", {}).get("name", "").lower()]
+    for group in candidates:
+        if group["profile"]["name"].lower() == f"{prefix}{department_name}".lower():
+            return group
+    return candidates[0] if candidates else None
+
+def group_stats_count(group):
+    """Member count from a group's expanded stats, or None when Okta did not include them."""
+    return group.get("_embedded", {}).get("stats", {}).get("usersCount")
+
+def cached_department_counts(client):
+    """Counts non-deprovisioned users per lowercased department from the local user cache."""
+    if cache_path() == 'off':
+        return None
+    cache = synced_cache(client)
+    return cache.count_by("profile.department", UserQuery(exclude_statuses=["DEPROVISIONED"]))
+
+def okta_group_search(pivot_data, client, prefix):
+    """Finds each department's Okta group in one listing and updates the pivot data with user counts.
+
+    Counts come from the group stats, then from the local user cache, and
+    only when the cache is switched off from paging through the group's members.
+    """
+    try:
+        groups = okta_prefixed_groups(client, prefix)
+    except requests.exceptions.HTTPError:
+        groups = []
+    department_counts = None
+    counts_loaded = False
     return_list = []
     for department in pivot_data.values():
         department_name = department["Department"]
-        try:
-            groups = get_paginated_data(f"{org_url}/api/v1/groups?q={department_name}", token)
-            for group in groups:
-                group_name = group.get("profile", {}).get("name", "")
-                if group_name.lower().startswith(prefix.lower()):
-                    department["Okta Count"] = okta_group_count(group["id"], org_url, token)
-                    break
-            else:
-                department["Okta Count"] = "N/A"
-        except requests.exceptions.HTTPError:
+        group = find_department_group(groups, department_name, prefix)
+        if group is None:
             department["Okta Count"] = "N/A"
+            return_list.append(department)
+            continue
+        count = group_stats_count(group)
+        if count is None and not counts_loaded:
+            department_counts = cached_department_counts(client)
+            counts_loaded = True
+        if count is None and department_counts is not None:
+            count = department_counts.get(department_name, 0)
+        if count is None:
+            try:
+                count = okta_group_count(group["id"], client)
+            except requests.exceptions.HTTPError:
+                count = "N/A"
+        department["Okta Count"] = count
         return_list.append(department)
     return return_list
 
@@ -109,6 +126,16 @@ def write_csv(data, output_path):
         print(f"Error writing CSV: {str(e)}")
         raise
 
+def pivot_rows(client, rows, output_path, prefix):
+    """Pivot enriched rows by department, add each department group's Okta count and write it out."""
+    pivot_data = pivot(rows)
+    pivot_data = okta_group_search(pivot_data, client, prefix)
+    write_csv(pivot_data, output_path)
+
+def pivot_file(client, input_file, output_path, prefix):
+    """pivot_rows for an enriched CSV."""
+    pivot_rows(client, get_users(input_file), output_path, prefix)
+
 def main():
     """Main function to execute the script."""
     # Load environment variables from .env file
@@ -138,10 +165,8 @@ def main():
 
     try:
         # Process the data
-        user_list = get_users(input_file)
-        pivot_data = pivot(user_list)
-        pivot_data = okta_group_search(pivot_data, OKTA_ORG_URL, OKTA_API_KEY, prefix)
-        write_csv(pivot_data, output_path)
+        with OktaClient(OKTA_ORG_URL, OKTA_API_KEY) as client:
+            pivot_file(client, input_file, output_path, prefix)
     except Exception as e:
         print(f"Error: {str(e)}")
         sys.exit(1)
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""One entry point for every report, without prompts.
+
+    python okta-scripts.py enrich --input export.csv --output enriched.csv
+    python okta-scripts.py pivot --input enriched.csv --output departments.csv --prefix dept-
+    python okta-scripts.py app-report --output ~/reports/apps --format csv,long
+    python okta-scripts.py fastpass --output fastpass.csv
+    python okta-scripts.py wipe --dry-run
+    python okta-scripts.py aggregate --by profile.department,profile.userType --pivot status
+    python okta-scripts.py snapshot --output ~/okta-snapshots/today
+    python okta-scripts.py diff ~/okta-snapshots/last-week ~/okta-snapshots/today --output changes.csv
+    python okta-scripts.py job nightly.json
+
+A job file runs several reports in one process. They share one HTTP
+client (connection pool, rate limits and the final metrics summary) and
+one user sync, so the org is crawled once however many reports need it:
+
+    {"jobs": [
+        {"report": "enrich", "input": "export.csv", "output": "enriched.csv"},
+        {"report": "pivot", "input": "enriched.csv", "output": "departments.csv", "prefix": "dept-"},
+        {"report": "fastpass", "output": "fastpass.csv"}
+    ]}
+
+Each job takes the same options as its subcommand, without the dashes.
+A pivot whose input is an earlier enrich job's output uses the enriched
+rows kept in memory instead of reading the file back, and the apps and
+groups lists fetched by one job are reused by later ones for
+OKTA_RESOURCE_TTL seconds.
+"""
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+from dotenv import load_dotenv
+from okta_client import create_client
+from factor_inventory import open_inventory
+from user_cache import cache_path, iter_org_users, synced_cache
+from user_query import UserQuery
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DOCUMENTS_DIR = os.path.expanduser("~/Documents")
+
+# Subcommand and the script that implements it
+SCRIPTS = {
+    'enrich': 'enrich_userdata_okta.py',
+    'pivot': 'okta-department-pivot.py',
+    'app-report': 'okta-app-assignment-report.py',
+    'fastpass': 'fastpass_report.py',
+    'wipe': 'mass-wipe-users.py',
+    'aggregate': 'aggregate.py',
+    'snapshot': 'snapshot.py',
+    'diff': 'diff.py',
+}
+DEFAULT_WORKERS = 8
+
+# Rows written by enrich runs in this process, by output path
+ENRICHED = {}
+# Users in a snapshot's users table, read the same way with or without the user cache
+SNAPSHOT_USERS = UserQuery(exclude_statuses=["DEPROVISIONED"])
+
+
+def load_script(command):
+    """Import a report script by file name; most of them are not valid module names."""
+    path = os.path.join(HERE, SCRIPTS[command])
+    name = os.path.splitext(SCRIPTS[command])[0].replace('-', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_enrich(client, args):
+    # Only held in memory when a later job reads this output (see keep_read_outputs)
+    rows = [] if args.keep_rows else None
+    ok = load_script('enrich').enrich_file(client, args.input, args.output, args.fuzzy, keep=rows)
+    if ok and rows is not None:
+        ENRICHED[args.output] = rows
+    return ok
+
+
+def run_pivot(client, args):
+    script = load_script('pivot')
+    rows = ENRICHED.get(os.path.abspath(os.path.expanduser(args.input)))
+    if rows is not None:
+        print(f"Using the enriched rows of {args.input} from this run")
+        script.pivot_rows(client, rows, args.output, args.prefix)
+    else:
+        script.pivot_file(client, args.input, args.output, args.prefix)
+    return True
+
+
+def run_app_report(client, args):
+    script = load_script('app-report')
+    location = args.output
+    for suffix, _ in script.WRITERS.values():
+        if location.endswith(suffix):
+            location = location[:-len(suffix)]
+    script.build_report(client, location, script.parse_formats(args.format), args.strategy, args.resume)
+    return True
+
+
+def run_fastpass(client, args):
+    load_script('fastpass').write_report(client, args.output, args.workers, args.resume)
+    return True
+
+
+def run_wipe(client, args):
+    script = load_script('wipe')
+    script.delete_users(client, args.dry_run, args.workers, args.journal, confirmed=args.yes)
+    return True
+
+
+def run_aggregate(client, args):
+    script = load_script('aggregate')
+    dimensions = split_list(args.by)
+    pivot_columns = split_list(args.pivot)
+    measures = {spec: script.parse_measure(spec) for spec in split_list(args.measure)}
+    names = list(dict.fromkeys(dimensions + pivot_columns
+                               + [measure.column for measure in measures.values() if measure.column]))
+    if args.snapshot:
+        table = load_script('snapshot').Snapshot(args.snapshot).read(args.table)
+        columns = {name: table[name] for name in names}
+    elif args.input:
+        rows = ENRICHED.get(os.path.abspath(os.path.expanduser(args.input)))
+        if rows is None:
+            rows = load_script('pivot').get_users(args.input)
+        columns = script.read_columns(rows, names)
+    elif cache_path() == 'off':
+        print("aggregate needs --input, --snapshot or the user cache (OKTA_USER_CACHE is off)")
+        return False
+    else:
+        columns = synced_cache(client).columns(names)
+    if pivot_columns:
+        table = script.pivot_table(columns, dimensions, pivot_columns, measures)
+    else:
+        table = script.group_by(columns, dimensions, measures)
+    load_script('pivot').write_csv(table, args.output)
+    return True
+
+
+def run_snapshot(client, args):
+    script = load_script('snapshot')
+    tables = split_list(args.tables)
+    for name in tables:
+        if name not in script.TABLES:
+            raise ValueError(f"Unknown snapshot table {name!r}; use {', '.join(script.TABLES)}")
+    snapshot = script.Snapshot(args.output)
+    info = {'org_url': client.org_url}
+    if 'users' in tables:
+        snapshot.write('users', script.users_table(iter_org_users(client, SNAPSHOT_USERS)), **info)
+    if 'apps' in tables:
+        snapshot.write('apps', script.apps_table(client.get_paginated_data("/api/v1/apps", shared=True)), **info)
+    if 'groups' in tables:
+        groups = client.get_paginated_data("/api/v1/groups", params={'expand': 'stats', 'limit': 200}, shared=True)
+        snapshot.write('groups', script.groups_table(groups), **info)
+    if 'assignments' in tables:
+        # Labels can repeat, so rows come from the app ids each crawl returned
+        assignments = {}
+        apps_dict, matrix = load_script('app-report').crawl_matrix(client, args.strategy, assignments=assignments)
+        snapshot.write('assignments', script.assignments_table(matrix.user_ids, apps_dict, assignments), **info)
+    if 'factors' in tables:
+        # Covers more users than fastpass, so it keeps its own System Log watermark
+        inventory = open_inventory(client, 'snapshot')
+        query = UserQuery(exclude_statuses=["DEPROVISIONED"], fields=("login",))
+        user_factors = load_script('fastpass').iter_user_factors(client, args.workers, inventory, query)
+        try:
+            snapshot.write('factors', script.factors_table(user_factors), **info)
+        except Exception:
+            if inventory is not None:
+                inventory.close()
+            raise
+        if inventory is not None:
+            inventory.finish()
+    return True
+
+
+def run_diff(client, args):
+    script = load_script('diff')
+    snapshots = load_script('snapshot')
+    old, new = snapshots.Snapshot(args.old), snapshots.Snapshot(args.new)
+    for snapshot in (old, new):
+        if not snapshot.meta['tables']:
+            raise ValueError(f"{snapshot.directory} is not a snapshot")
+    script.write_change_report(script.diff_snapshots(old, new, split_list(args.tables) or None), args.output)
+    return True
+
+
+def split_list(value):
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="okta-scripts", description="Okta reports and bulk operations.")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="parallel requests (threads, or coroutines with --backend async)")
+    parser.add_argument('--backend', choices=['sync', 'async'], default=None, help="default: OKTA_BACKEND or sync")
+    parser.add_argument('--full-sync', action='store_true', help="rebuild the user cache from scratch")
+    parser.set_defaults(offline=False, keep_rows=False)
+    commands = parser.add_subparsers(dest='command', required=True)
+    add_command_parsers(commands)
+
+    job = commands.add_parser('job', help="run the reports listed in a JSON job file")
+    job.add_argument('job_file')
+    return parser
+
+
+def add_command_parsers(commands):
+    enrich = commands.add_parser('enrich', help="add Okta department and status to a CSV export")
+    enrich.add_argument('--input', required=True, help="CSV with Email, First and Last columns")
+    enrich.add_argument('--output', help="default: ~/Documents/<input name>_enriched.csv")
+    enrich.add_argument('--fuzzy', action='store_true', help="fuzzy match names that found no exact match")
+    enrich.set_defaults(run=run_enrich)
+
+    pivot = commands.add_parser('pivot', help="count an enriched CSV's users per department against Okta groups")
+    pivot.add_argument('--input', required=True, help="CSV with Department and Okta Status columns")
+    pivot.add_argument('--output', help="default: ~/Documents/<input name>_pivot.csv")
+    pivot.add_argument('--prefix', required=True, help="department group prefix, e.g. dept. or dept-")
+    pivot.set_defaults(run=run_pivot)
+
+    app_report = commands.add_parser('app-report', help="which users are assigned which apps")
+    app_report.add_argument('--output', default=os.path.join(DOCUMENTS_DIR, "Applications_report"),
+                            help="output path without extension")
+    app_report.add_argument('--format', default='csv', help="comma separated: csv, long, parquet")
+    app_report.add_argument('--strategy', choices=['auto', 'apps', 'users'], default='auto')
+    app_report.add_argument('--resume', action='store_true')
+    app_report.set_defaults(run=run_app_report)
+
+    fastpass = commands.add_parser('fastpass', help="FastPass devices enrolled per user")
+    fastpass.add_argument('--output', default=os.path.join(DOCUMENTS_DIR, "fastpass_report.csv"))
+    fastpass.add_argument('--resume', action='store_true')
+    fastpass.set_defaults(run=run_fastpass)
+
+    wipe = commands.add_parser('wipe', help="deactivate and delete every user outside IT")
+    wipe.add_argument('--dry-run', action='store_true', help="only print the plan")
+    wipe.add_argument('--yes', action='store_true', help="skip the typed DELETE confirmation")
+    wipe.add_argument('--journal', default=os.path.expanduser("~/.okta-scripts/wipe-journal.jsonl"))
+    wipe.set_defaults(run=run_wipe)
+
+    aggregate = commands.add_parser('aggregate', help="count users by any attributes, optionally pivoted")
+    aggregate.add_argument('--input', help="CSV to aggregate; default: the synced user cache, with attributes"
+                                           " named like status or profile.department")
+    aggregate.add_argument('--snapshot', help="snapshot directory to aggregate instead")
+    aggregate.add_argument('--table', default='users', help="snapshot table, default users")
+    aggregate.add_argument('--by', required=True, help="comma separated columns to group by")
+    aggregate.add_argument('--pivot', help="comma separated columns whose values become output columns")
+    aggregate.add_argument('--measure', default='count',
+                           help="comma separated: count, COLUMN=VALUE, COLUMN!=VALUE, sum:COLUMN, distinct:COLUMN")
+    aggregate.add_argument('--output', default=os.path.join(DOCUMENTS_DIR, "aggregate.csv"))
+    aggregate.set_defaults(run=run_aggregate)
+
+    snapshot = commands.add_parser('snapshot', help="save users, apps, groups, assignments and factors as"
+                                                    " compressed columnar files")
+    snapshot.add_argument('--output', required=True, help="snapshot directory")
+    snapshot.add_argument('--tables', default='users,apps,groups,assignments,factors',
+                          help="comma separated tables to save")
+    snapshot.add_argument('--strategy', choices=['auto', 'apps', 'users'], default='auto',
+                          help="assignment crawl strategy, as for app-report")
+    snapshot.set_defaults(run=run_snapshot)
+
+    diff = commands.add_parser('diff', help="who gained or lost access, department or devices between two snapshots")
+    diff.add_argument('old', help="earlier snapshot directory")
+    diff.add_argument('new', help="later snapshot directory")
+    diff.add_argument('--output', default=os.path.join(DOCUMENTS_DIR, "changes.csv"))
+    diff.add_argument('--tables', help="comma separated tables to compare, default every table both have")
+    diff.set_defaults(run=run_diff, offline=True)
+
+
+def default_output(args):
+    """Fill in output paths that depend on the input file name."""
+    if args.command in ('enrich', 'pivot') and not args.output:
+        stem = os.path.splitext(os.path.basename(args.input))[0]
+        suffix = '_enriched' if args.command == 'enrich' else '_pivot'
+        args.output = os.path.join(DOCUMENTS_DIR, f"{stem}{suffix}.csv")
+    if hasattr(args, 'output'):
+        args.output = os.path.abspath(os.path.expanduser(args.output))
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+
+
+def keep_read_outputs(jobs):
+    """Have enrich jobs keep their rows only when a later job reads their output."""
+    for position, job in enumerate(jobs):
+        if job.command == 'enrich':
+            job.keep_rows = any(
+                getattr(later, 'input', None) and os.path.abspath(os.path.expanduser(later.input)) == job.output
+                for later in jobs[position + 1:]
+            )
+
+
+def job_arguments(job):
+    """Turn one job file entry into the command line of its subcommand."""
+    job = dict(job)
+    argv = [job.pop('report')]
+    for key, value in job.items():
+        flag = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(flag)
+        elif value not in (False, None):
+            argv += [flag, str(value)]
+    return argv
+
+
+def load_jobs(parser, path):
+    """Parse every job up front so a typo fails before anything runs."""
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    jobs = spec['jobs'] if isinstance(spec, dict) else spec
+    parsed = []
+    for job in jobs:
+        if job.get('report') not in SCRIPTS:
+            parser.error(f"{path}: unknown report {job.get('report')!r}; use {', '.join(SCRIPTS)}")
+        parsed.append(parser.parse_args(job_arguments(job)))
+    return parsed
+
+
+def main():
+    load_dotenv()
+    parser = build_parser()
+    args = parser.parse_args()
+
+    if args.full_sync:
+        os.environ['OKTA_FULL_SYNC'] = '1'
+    if args.command == 'job':
+        jobs = load_jobs(parser, args.job_file)
+        if os.getenv('OKTA_USER_CACHE') == 'off':
+            # Keep the one crawl in memory so every job can reuse it
+            os.environ['OKTA_USER_CACHE'] = ':memory:'
+    else:
+        jobs = [args]
+
+    for job in jobs:
+        default_output(job)
+    keep_read_outputs(jobs)
+    workers = args.workers or DEFAULT_WORKERS
+    if all(job.offline for job in jobs):
+        # Nothing to ask Okta, so no credentials are needed
+        client = contextlib.nullcontext()
+    else:
+        OKTA_ORG_URL = os.getenv('OKTA_ORG_URL')
+        OKTA_API_KEY = os.getenv('OKTA_API_KEY')
+        if not OKTA_ORG_URL or not OKTA_API_KEY:
+            parser.error("OKTA_ORG_URL and OKTA_API_KEY must be set in the environment or a .env file")
+        client = create_client(OKTA_ORG_URL, OKTA_API_KEY, workers=workers, backend=args.backend)
+    failed = 0
+    with client:
+        for job in jobs:
+            job.workers = workers
+            print(f"== {job.command} ==")
+            try:
+                ok = job.run(client, job)
+            except Exception as e:
+                print(f"{job.command} failed: {e}")
+                ok = False
+            failed += not ok
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""asyncio backend for OktaClient built on httpx.
+
+AsyncOktaClient offers the same calls as OktaClient, so report scripts can
+switch between them with OKTA_BACKEND=async. Requests run on an event loop
+in a background thread: fan-out crawls submitted with submit_paginated
+become coroutines instead of threads, so thousands of them can be in
+flight at once, limited only by an asyncio semaphore. With the optional
+h2 package installed they are multiplexed over a few HTTP/2 connections.
+
+Pacing, retries and pagination follow the sync client exactly: the same
+RateGovernor is consulted before every request and fed every response,
+and HTTP errors are raised as requests exceptions so callers catch the
+same things whichever backend they run on.
+
+httpx is only needed when this backend is selected: pip install httpx[http2]
+"""
+import asyncio
+import threading
+import requests
+from okta_client import DEFAULT_MAX_RETRIES, DEFAULT_TIMEOUT, OktaClient, next_link
+from metrics import RunMetrics, verbose
+from rate_governor import RateGovernor, backoff_delay, bucket_for, retry_after
+from resource_cache import ResourceCache, chain
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+DEFAULT_CONCURRENCY = 200
+
+
+class AsyncOktaClient:
+    """Okta client whose requests run as coroutines on a private event loop.
+
+    The blocking methods (get, iter_items, get_paginated_data, ...) may be
+    called from any thread; submit_paginated returns a concurrent.futures
+    Future so results can be consumed the same way as the sync client's.
+    """
+
+    def __init__(self, org_url, token, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT,
+                 governor=None, max_retries=DEFAULT_MAX_RETRIES, http2=True, metrics=None, resources=None):
+        if httpx is None:
+            raise ImportError("OKTA_BACKEND=async needs httpx: pip install httpx[http2]")
+        self.org_url = org_url.rstrip('/')
+        self.timeout = timeout
+        self.governor = governor or RateGovernor()
+        self.metrics = metrics or RunMetrics()
+        self.resources = resources or ResourceCache()
+        self.max_retries = max_retries
+        self.concurrency = concurrency
+        self.headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f'SSWS {token}'
+        }
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="okta-async", daemon=True)
+        self.thread.start()
+        self.run(self.open())
+
+    async def open(self):
+        # Created on the loop they will be used from
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.learned = {}
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        self.http = httpx.AsyncClient(headers=self.headers, timeout=self.timeout, limits=limits, http2=self.http2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.run(self.http.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.metrics.report()
+
+    def run(self, coroutine):
+        """Run a coroutine on the client's loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    url = OktaClient.url
+    should_retry = staticmethod(OktaClient.should_retry)
+
+    async def first_response(self, url):
+        """Hold back a new endpoint family until one response has shown its rate limit.
+
+        The governor cannot pace requests before it has seen the limit, and
+        with hundreds of coroutines ready the opening burst alone could
+        exhaust it.
+        """
+        name = bucket_for(url)
+        learned = self.learned.get(name)
+        if learned is None:
+            self.learned[name] = asyncio.Event()
+        else:
+            await learned.wait()
+
+    async def arequest(self, method, endpoint, **kwargs):
+        """Send a paced request, retrying 429s and transient 5xx errors."""
+        url = self.url(endpoint)
+        if method.upper() not in ('GET', 'HEAD'):
+            # A change in Okta may make any remembered collection stale
+            self.resources.clear()
+        await self.first_response(url)
+        attempt = 0
+        while True:
+            async with self.semaphore:
+                wait = self.governor.delay(url)
+                if wait:
+                    self.metrics.rate_limit_sleep(url, wait)
+                    await asyncio.sleep(wait)
+                started = self.metrics.start()
+                response = None
+                try:
+                    response = await self.http.request(method, url, **kwargs)
+                    self.governor.update(url, response)
+                except httpx.TransportError as e:
+                    raise requests.exceptions.ConnectionError(f"{method} {url}: {e}") from e
+                finally:
+                    self.governor.release(url)
+                    self.learned[bucket_for(url)].set()
+                    if response is None:
+                        self.metrics.finish(url, started)
+                    else:
+                        self.metrics.finish(url, started, response.status_code, len(response.content))
+            if attempt >= self.max_retries or not self.should_retry(method, response):
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            print(f"Got {response.status_code} from {response.url}. Retrying in {delay:.1f} seconds")
+            self.metrics.retry(url, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aget(self, endpoint, params=None, headers=None):
+        """GET a single page and raise on HTTP errors."""
+        response = await self.arequest('GET', endpoint, params=params, headers=headers)
+        if verbose():
+            print(f"Fetching: {response.url}")
+        if response.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                f"{response.status_code} Error for url: {response.url}: {response.text[:500]}")
+        self.metrics.page(str(response.url))
+        return response
+
+    async def aiter_pages(self, endpoint, params=None, headers=None):
+        """Yield each page of a collection as soon as it arrives."""
+        url = endpoint
+        while url:
+            response = await self.aget(url, params=params, headers=headers)
+            params = None
+            url = next_link(response)
+            yield response.json()
+
+    async def aget_paginated_data(self, endpoint, params=None, headers=None, pick=None):
+        """Fetch every item of a collection, optionally keeping only pick(item)."""
+        items = []
+        async for page in self.aiter_pages(endpoint, params, headers):
+            items.extend(map(pick, page) if pick else page)
+        return items
+
+    claim = OktaClient.claim
+
+    def submit_paginated(self, endpoint, params=None, headers=None, pick=None, shared=False):
+        """Start crawling a collection in the background; return a Future of its items."""
+        future, new = self.claim(endpoint, params, headers, pick, shared)
+        if new:
+            chain(asyncio.run_coroutine_threadsafe(
+                self.aget_paginated_data(endpoint, params, headers, pick), self.loop), future)
+        return future
+
+    def request(self, method, endpoint, **kwargs):
+        return self.run(self.arequest(method, endpoint, **kwargs))
+
+    def get(self, endpoint, params=None, headers=None):
+        return self.run(self.aget(endpoint, params, headers))
+
+    # Built on get, so they behave exactly like the sync client's
+    iter_pages_with_cursor = OktaClient.iter_pages_with_cursor
+    iter_pages = OktaClient.iter_pages
+    iter_items = OktaClient.iter_items
+    iter_users = OktaClient.iter_users
+
+    def get_paginated_data(self, endpoint, params=None, headers=None, shared=False):
+        """Fetch every page of a collection into a single list (do not modify it)."""
+        return self.submit_paginated(endpoint, params, headers, shared=shared).result()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Shared Okta API client used by the report scripts."""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import RunMetrics, verbose
+from rate_governor import RateGovernor, backoff_delay, retry_after
+from resource_cache import ResourceCache, resource_key, settle
+from user_query import OMIT_CREDENTIALS, UserQuery
+
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_RETRIES = 5
+# Only these are retried on 5xx; a lifecycle DELETE may already have happened
+RETRY_5XX_METHODS = {'GET', 'HEAD'}
+
+
+def next_link(response):
+    """Return the rel="next" URL from a response's Link header, or None."""
+    return response.links.get('next', {}).get('url')
+
+
+class OktaClient:
+    """Pooled keep-alive session against a single Okta org.
+
+    Safe to share between worker threads. Every request is paced by a
+    RateGovernor, which can also be shared between clients, and recorded
+    in RunMetrics, whose summary is printed when the client closes. Whole
+    collection fetches go through a ResourceCache so overlapping ones are
+    only sent once, and shared ones are not sent again.
+    """
+
+    def __init__(self, org_url, token, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 governor=None, max_retries=DEFAULT_MAX_RETRIES, metrics=None, resources=None):
+        self.org_url = org_url.rstrip('/')
+        self.timeout = timeout
+        self.governor = governor or RateGovernor()
+        self.metrics = metrics or RunMetrics()
+        self.resources = resources or ResourceCache()
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.executor = None
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'Authorization': f'SSWS {token}'
+        })
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.session.close()
+        self.metrics.report()
+
+    def url(self, endpoint):
+        """Resolve an API path like /api/v1/users against the org URL."""
+        if endpoint.startswith(('http://', 'https://')):
+            return endpoint
+        return f"{self.org_url}{endpoint}"
+
+    def request(self, method, endpoint, **kwargs):
+        """Send a paced request, retrying 429s and transient 5xx errors."""
+        kwargs.setdefault('timeout', self.timeout)
+        url = self.url(endpoint)
+        if method.upper() not in ('GET', 'HEAD'):
+            # A change in Okta may make any remembered collection stale
+            self.resources.clear()
+        attempt = 0
+        while True:
+            self.metrics.rate_limit_sleep(url, self.governor.acquire(url))
+            started = self.metrics.start()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                self.governor.update(url, response)
+            finally:
+                self.governor.release(url)
+                if response is None:
+                    self.metrics.finish(url, started)
+                else:
+                    self.metrics.finish(url, started, response.status_code, len(response.content))
+            if attempt >= self.max_retries or not self.should_retry(method, response):
+                return response
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            print(f"Got {response.status_code} from {response.url}. Retrying in {delay:.1f} seconds")
+            self.metrics.retry(url, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def should_retry(method, response):
+        if response.status_code == 429:
+            return True
+        return response.status_code >= 500 and method.upper() in RETRY_5XX_METHODS
+
+    def get(self, endpoint, params=None, headers=None):
+        """GET a single page and raise on HTTP errors."""
+        response = self.request('GET', endpoint, params=params, headers=headers)
+        if verbose():
+            print(f"Fetching: {response.url}")
+        response.raise_for_status()
+        self.metrics.page(response.url)
+        return response
+
+    def iter_pages_with_cursor(self, endpoint, params=None, headers=None):
+        """Yield (page, next page URL) pairs; the URL is None on the last page.
+
+        Saving the URL after a page is processed is enough to resume the
+        crawl later by passing it back in as endpoint.
+        """
+        url = endpoint
+        while url:
+            response = self.get(url, params=params, headers=headers)
+            # The next link already carries the query string
+            params = None
+            url = next_link(response)
+            yield response.json(), url
+
+    def iter_pages(self, endpoint, params=None, headers=None):
+        """Yield each page of a collection as soon as it arrives."""
+        for page, _ in self.iter_pages_with_cursor(endpoint, params, headers):
+            yield page
+
+    def iter_items(self, endpoint, params=None, headers=None):
+        """Yield records one at a time; memory stays bounded by the page size."""
+        for page in self.iter_pages(endpoint, params, headers):
+            yield from page
+
+    def iter_users(self, query=None):
+        """Yield users matching query, filtered on Okta's side where possible."""
+        query = query or UserQuery()
+        for user in self.iter_items("/api/v1/users", params=query.params(), headers=OMIT_CREDENTIALS):
+            if query.matches(user):
+                yield query.project(user)
+
+    def claim(self, endpoint, params=None, headers=None, pick=None, shared=False):
+        """Future for a collection from the ResourceCache, and whether this caller must fetch it."""
+        url = self.url(endpoint)
+        future, new = self.resources.claim(resource_key(url, params, headers, pick), keep=shared)
+        if not new:
+            self.metrics.reuse(url)
+        return future, new
+
+    def get_paginated_data(self, endpoint, params=None, headers=None, shared=False):
+        """Fetch every page of a collection into a single list (do not modify it).
+
+        shared=True keeps the list for OKTA_RESOURCE_TTL seconds, for org-wide
+        collections that other commands in the run read too.
+        """
+        future, new = self.claim(endpoint, params, headers, shared=shared)
+        if new:
+            settle(future, lambda: self.collect(endpoint, params, headers))
+        return future.result()
+
+    def submit_paginated(self, endpoint, params=None, headers=None, pick=None, shared=False):
+        """Start crawling a collection on a worker thread; return a Future of its items.
+
+        pick, if given, is applied to every item as it arrives so large
+        collections can be reduced to what the caller keeps. It is part of
+        the cache key, so pass the same function for crawls to be merged.
+        shared is as for get_paginated_data.
+        """
+        future, new = self.claim(endpoint, params, headers, pick, shared)
+        if new:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.pool_size)
+            self.executor.submit(settle, future, lambda: self.collect(endpoint, params, headers, pick))
+        return future
+
+    def collect(self, endpoint, params=None, headers=None, pick=None):
+        items = self.iter_items(endpoint, params, headers)
+        return list(map(pick, items) if pick else items)
+
+
+def create_client(org_url, token, workers=DEFAULT_POOL_SIZE, backend=None, **kwargs):
+    """Client for the backend named by OKTA_BACKEND: 'sync' (default) or 'async'.
+
+    workers is the number of threads for the sync client and the number of
+    concurrent requests for the async one.
+    """
+    backend = backend or os.getenv('OKTA_BACKEND', 'sync')
+    if backend == 'async':
+        from okta_async import AsyncOktaClient
+        return AsyncOktaClient(org_url, token, concurrency=workers, **kwargs)
+    if backend != 'sync':
+        raise ValueError(f"Unknown OKTA_BACKEND {backend!r}; use 'sync' or 'async'")
+    return OktaClient(org_url, token, pool_size=workers, **kwargs)
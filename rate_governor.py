@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""Per-endpoint rate limit pacing for the Okta API.
+
+Okta publishes a separate limit for each endpoint family and reports it
+on every response through x-rate-limit-limit, x-rate-limit-remaining and
+x-rate-limit-reset. The governor keeps one token bucket per family and
+spaces requests evenly over the time left in the window, so a long crawl
+runs at a steady rate instead of bursting into the limit and stalling.
+"""
+import email.utils
+import math
+import random
+import re
+import threading
+import time
+from datetime import timezone
+from urllib.parse import urlparse
+
+
+# Most specific first: /users/{id}/factors must not fall into /users
+ENDPOINT_BUCKETS = [
+    ('/api/v1/users/*/factors', re.compile(r'^/api/v1/users/[^/]+/factors')),
+    ('/api/v1/apps/*/users', re.compile(r'^/api/v1/apps/[^/]+/users')),
+    ('/api/v1/groups', re.compile(r'^/api/v1/groups')),
+    ('/api/v1/apps', re.compile(r'^/api/v1/apps')),
+    ('/api/v1/users', re.compile(r'^/api/v1/users')),
+    ('/api/v1/logs', re.compile(r'^/api/v1/logs')),
+]
+
+# Requests allowed per window for each endpoint family, roughly Okta's defaults per minute
+DEFAULT_LIMITS = {
+    '/api/v1/users': 600,
+    '/api/v1/users/*/factors': 600,
+    '/api/v1/apps': 100,
+    '/api/v1/apps/*/users': 500,
+    '/api/v1/groups': 500,
+    '/api/v1/logs': 120,
+}
+DEFAULT_HEADROOM = 1
+DEFAULT_WINDOW = 60
+BACKOFF_BASE = 1
+BACKOFF_CAP = 60
+
+
+def bucket_for(url):
+    """Map a request URL or path to the rate limit bucket it counts against."""
+    path = urlparse(url).path
+    for name, pattern in ENDPOINT_BUCKETS:
+        if pattern.match(path):
+            return name
+    return path
+
+
+def retry_after(response):
+    """Seconds to wait before retrying a throttled or failed response, or None."""
+    value = response.headers.get('Retry-After')
+    if value:
+        # Seconds ("120", sometimes "1.5") or an HTTP date; anything else falls back to backoff
+        try:
+            seconds = float(value)
+        except ValueError:
+            seconds = None
+        if seconds is not None:
+            return max(seconds, 0) if math.isfinite(seconds) else None
+        try:
+            retry_at = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(retry_at.timestamp() - time.time(), 0)
+    if response.status_code == 429 and 'x-rate-limit-reset' in response.headers:
+        return max(int(response.headers['x-rate-limit-reset']) - time.time() + 1, 0)
+    return None
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter for the given retry attempt."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Pacing state for one endpoint family."""
+
+    def __init__(self, headroom=DEFAULT_HEADROOM, window=DEFAULT_WINDOW):
+        self.headroom = headroom
+        self.window = window
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        # Responses from before this reset belong to a finished window
+        self.previous_reset = None
+        # True while reset_at is our own guess rather than a server value
+        self.estimated = False
+        # Last reset time the server reported, used to learn the window length
+        self.server_reset = None
+        self.next_slot = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, now):
+        """Claim the next send slot and return the time it opens."""
+        with self.lock:
+            self.in_flight += 1
+            if self.remaining is None:
+                # Nothing learned yet; the first response fills the bucket in
+                return now
+            if self.reset_at <= now:
+                self.start_window(now)
+            if self.remaining <= self.headroom:
+                slot = max(self.reset_at + 1, self.next_slot)
+                self.start_window(slot)
+                self.next_slot = slot
+            else:
+                slot = max(now, self.next_slot)
+                interval = (self.reset_at - slot) / max(self.remaining - self.headroom, 1)
+                self.next_slot = slot + max(interval, 0)
+            self.remaining -= 1
+            return slot
+
+    def start_window(self, start):
+        self.previous_reset = self.reset_at
+        self.remaining = self.limit
+        self.reset_at = start + self.window
+        self.estimated = True
+
+    def update(self, headers):
+        """Resync from the rate limit headers of a response."""
+        if 'x-rate-limit-remaining' not in headers:
+            return
+        with self.lock:
+            self.limit = int(headers.get('x-rate-limit-limit', self.limit or headers['x-rate-limit-remaining']))
+            reset_at = int(headers.get('x-rate-limit-reset', time.time() + self.window))
+            if self.previous_reset is not None and reset_at <= self.previous_reset:
+                return
+            if self.server_reset is not None and reset_at > self.server_reset:
+                # Consecutive resets are one window apart; guess the next window from them
+                self.window = reset_at - self.server_reset
+            self.server_reset = max(reset_at, self.server_reset or 0)
+            # The server has not counted requests still in flight yet
+            remaining = int(headers['x-rate-limit-remaining']) - (self.in_flight - 1)
+            if self.reset_at is None or self.estimated or reset_at > self.reset_at:
+                # A new window has started
+                if self.reset_at is not None and reset_at > self.reset_at:
+                    self.previous_reset = self.reset_at
+                self.reset_at = reset_at
+                self.remaining = remaining
+                self.estimated = False
+            else:
+                # Responses arrive out of order under concurrency; trust the lowest count
+                self.remaining = min(self.remaining, remaining)
+
+    def release(self):
+        """Mark one reserved request as finished, whatever its outcome."""
+        with self.lock:
+            self.in_flight -= 1
+
+
+class RateGovernor:
+    """Token buckets for every endpoint family, shared by all worker threads."""
+
+    def __init__(self, headroom=DEFAULT_HEADROOM, window=DEFAULT_WINDOW, sleep=time.sleep):
+        self.headroom = headroom
+        self.window = window
+        self.sleep = sleep
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, url):
+        name = bucket_for(url)
+        with self.lock:
+            if name not in self.buckets:
+                self.buckets[name] = TokenBucket(self.headroom, self.window)
+            return self.buckets[name]
+
+    def delay(self, url):
+        """Reserve a slot for a request to url and return how long to wait for it."""
+        now = time.time()
+        wait = self.bucket(url).reserve(now) - now
+        if wait <= 0:
+            return 0
+        if wait > 1:
+            print(f"Rate limit reached for {bucket_for(url)}. Sleeping {wait:.0f} seconds")
+        return wait
+
+    def acquire(self, url):
+        """Block until a request to url may be sent; return the seconds waited."""
+        wait = self.delay(url)
+        if wait:
+            self.sleep(wait)
+        return wait
+
+    def limit(self, url):
+        """Requests per window for url's family: as Okta last reported it, else the usual default."""
+        return self.bucket(url).limit or DEFAULT_LIMITS.get(bucket_for(url))
+
+    def update(self, url, response):
+        self.bucket(url).update(response.headers)
+
+    def release(self, url):
+        self.bucket(url).release()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""In-process memo of collection fetches, shared by everything using one client.
+
+Collections are keyed by URL, query parameters and headers. A caller that
+asks for a collection another caller is already fetching waits for that
+same request instead of sending its own. Collections claimed with
+keep=True (the org-wide lists several commands read, like apps and
+groups) are also stored once finished, and handed out until they are
+OKTA_RESOURCE_TTL seconds old (default 300; 0 only merges requests that
+overlap). Per-user and per-app lists are dropped as soon as they finish,
+so a crawl's memory does not grow with the org. Failed fetches are never
+stored.
+
+Results are shared, so callers must not modify the lists they get back.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+
+DEFAULT_TTL = 300
+
+
+def resource_ttl():
+    return float(os.getenv('OKTA_RESOURCE_TTL', DEFAULT_TTL))
+
+
+def resource_key(url, params=None, headers=None, pick=None):
+    """Hashable identity of a collection fetch."""
+    return (
+        url,
+        tuple(sorted((params or {}).items())),
+        tuple(sorted((headers or {}).items())),
+        pick,
+    )
+
+
+class ResourceCache:
+    """Futures of collection fetches by resource_key, with TTL expiry."""
+
+    def __init__(self, ttl=None, clock=time.monotonic):
+        self.ttl = resource_ttl() if ttl is None else ttl
+        self.clock = clock
+        self.entries = {}
+        self.expires = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key, keep=False):
+        """Return (future, True) if the caller must fetch key, or (future, False) to reuse one.
+
+        With keep, the result is stored for the TTL once it is fetched.
+        """
+        with self.lock:
+            self.evict(self.clock())
+            future = self.entries.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.entries[key] = future
+        future.add_done_callback(lambda done: self.finished(key, done, keep))
+        return future, True
+
+    def finished(self, key, future, keep):
+        with self.lock:
+            if self.entries.get(key) is not future:
+                # Cleared while it was being fetched
+                return
+            if keep and future.exception() is None and self.ttl > 0:
+                now = self.clock()
+                self.evict(now)
+                self.expires[key] = now + self.ttl
+            else:
+                # Let the next caller fetch it again
+                del self.entries[key]
+
+    def evict(self, now):
+        for key in [key for key, expires in self.expires.items() if expires <= now]:
+            del self.expires[key]
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """Forget everything, e.g. after changing users in Okta."""
+        with self.lock:
+            self.entries.clear()
+            self.expires.clear()
+
+
+def settle(future, fetch):
+    """Run fetch() and put its result or exception into future."""
+    try:
+        future.set_result(fetch())
+    except Exception as e:
+        future.set_exception(e)
+
+
+def chain(source, target):
+    """Copy source's outcome into target once source is done."""
+    def copy(done):
+        if done.exception() is not None:
+            target.set_exception(done.exception())
+        else:
+            target.set_result(done.result())
+    source.add_done_callback(copy)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Compressed columnar snapshots of an org: users, apps, groups, assignments and factors.
+
+A snapshot is a directory with one file per table plus snapshot.json
+describing it. With pyarrow installed each table is an Arrow IPC file
+compressed with zstd and read back through a memory map; without it,
+tables are gzipped JSON holding one list per column. Either way a table
+is read back as columns (name -> list of values), ready for aggregate
+and diff, with no CSV to parse.
+
+    snapshot = Snapshot("~/okta-snapshots/2024-06-01")
+    snapshot.write("users", users_table(cache.iter_users()))
+    columns = Snapshot("~/okta-snapshots/2024-06-01").read("users")
+
+This sits alongside the CSV reports; it does not replace them.
+"""
+import gzip
+import importlib.util
+import json
+import os
+import time
+from assignment_matrix import load_pyarrow
+from user_query import lookup
+
+
+# Table file suffix per format
+ARROW_SUFFIX = '.arrow'
+JSON_SUFFIX = '.json.gz'
+TABLES = ['users', 'apps', 'groups', 'assignments', 'factors']
+# Dotted user attributes kept in the users table, named as in aggregate and user_cache
+USER_ATTRIBUTES = [
+    'id', 'status', 'created', 'lastUpdated',
+    'profile.login', 'profile.email', 'profile.secondEmail', 'profile.firstName', 'profile.lastName',
+    'profile.userType', 'profile.department', 'profile.title', 'profile.manager', 'profile.organization',
+]
+
+
+def snapshot_format():
+    """'arrow' when pyarrow is installed, else 'json'; OKTA_SNAPSHOT_FORMAT=json forces the fallback."""
+    installed = importlib.util.find_spec('pyarrow') is not None
+    requested = os.getenv('OKTA_SNAPSHOT_FORMAT', 'arrow' if installed else 'json')
+    if requested not in ('arrow', 'json'):
+        raise ValueError(f"Unknown OKTA_SNAPSHOT_FORMAT {requested!r}; use arrow or json")
+    return requested
+
+
+def write_table(path, columns, table_format=None):
+    """Write columns to path plus the format's suffix and return the file written."""
+    table_format = table_format or snapshot_format()
+    if table_format == 'arrow':
+        pyarrow = load_pyarrow("OKTA_SNAPSHOT_FORMAT=arrow", 'pyarrow.ipc')
+        path += ARROW_SUFFIX
+        table = pyarrow.table(columns)
+        options = pyarrow.ipc.IpcWriteOptions(compression='zstd')
+        with pyarrow.OSFile(path, 'wb') as sink, pyarrow.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+    else:
+        path += JSON_SUFFIX
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump(columns, f, separators=(',', ':'))
+    return path
+
+
+def read_table(path):
+    """Columns of the table stored at path (without suffix), in whichever format it was written."""
+    if os.path.exists(path + ARROW_SUFFIX):
+        pyarrow = load_pyarrow(f"Reading {path + ARROW_SUFFIX}", 'pyarrow.ipc')
+        with pyarrow.memory_map(path + ARROW_SUFFIX) as source:
+            return pyarrow.ipc.open_file(source).read_all().to_pydict()
+    with gzip.open(path + JSON_SUFFIX, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Snapshot:
+    """A directory of tables written by one run."""
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.meta_path = os.path.join(self.directory, "snapshot.json")
+        self.meta = {'tables': {}}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+
+    def __contains__(self, name):
+        return name in self.meta['tables']
+
+    def write(self, name, columns, **info):
+        """Store a table and record its row count and any info (org URL, say) in snapshot.json."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = write_table(os.path.join(self.directory, name), columns)
+        rows = len(next(iter(columns.values()), []))
+        self.meta['tables'][name] = {'file': os.path.basename(path), 'rows': rows, 'written': time.time()}
+        self.meta.update(info)
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+        print(f"Snapshot table {name}: {rows} rows, {os.path.getsize(path) / 1e6:.1f} MB at {path}")
+
+    def read(self, name):
+        if name not in self:
+            raise KeyError(f"No {name} table in snapshot {self.directory}")
+        return read_table(os.path.join(self.directory, name))
+
+
+def text(value):
+    """Column cell as a string, so every column has one type ('' for missing)."""
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def users_table(users, attributes=USER_ATTRIBUTES):
+    users = users if isinstance(users, list) else list(users)
+    return {name: [text(lookup(user, name)) for user in users] for name in attributes}
+
+
+def apps_table(apps):
+    apps = list(apps)
+    return {
+        'id': [app['id'] for app in apps],
+        'label': [text(app.get('label')) for app in apps],
+        'status': [text(app.get('status')) for app in apps],
+    }
+
+
+def groups_table(groups):
+    groups = list(groups)
+    return {
+        'id': [group['id'] for group in groups],
+        'name': [text(lookup(group, 'profile.name')) for group in groups],
+        'users': [lookup(group, '_embedded.stats.usersCount') for group in groups],
+    }
+
+
+def assignments_table(user_ids, apps_dict, assignments):
+    """One row per assignment from the app ids collected by crawl_matrix, in user then app order."""
+    order = {app_id: index for index, app_id in enumerate(apps_dict)}
+    columns = {'user_id': [], 'app_id': []}
+    for user_id in user_ids:
+        for app_id in sorted(set(assignments.get(user_id, ())), key=order.get):
+            columns['user_id'].append(user_id)
+            columns['app_id'].append(app_id)
+    return columns
+
+
+def factors_table(user_factors):
+    """One row per factor from (user, factors) pairs."""
+    columns = {name: [] for name in ('user_id', 'id', 'factorType', 'status', 'platform', 'name')}
+    for user, factors in user_factors:
+        for factor in factors or []:
+            columns['user_id'].append(user['id'])
+            columns['id'].append(factor.get('id', ''))
+            columns['factorType'].append(text(factor.get('factorType')))
+            columns['status'].append(text(factor.get('status')))
+            columns['platform'].append(text(lookup(factor, 'profile.platform')))
+            columns['name'].append(text(lookup(factor, 'profile.name')))
+    return columns
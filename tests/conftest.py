@@ -0,0 +1,49 @@
+"""Shared fixtures: a fake_okta org on localhost and per-test state directories."""
+import os
+import sys
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+from fake_okta import FakeOkta, SyntheticOrg  # noqa: E402
+from okta_client import OktaClient  # noqa: E402
+import user_cache  # noqa: E402
+
+
+@pytest.fixture
+def state(tmp_path, monkeypatch):
+    """Point every on-disk store at tmp_path and forget caches synced by earlier tests."""
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('OKTA_USER_CACHE', str(tmp_path / "users.sqlite3"))
+    monkeypatch.setenv('OKTA_FACTOR_CACHE', str(tmp_path / "factors.sqlite3"))
+    monkeypatch.setenv('OKTA_CHECKPOINT_DIR', str(tmp_path / "checkpoints"))
+    monkeypatch.setenv('OKTA_SNAPSHOT_FORMAT', 'json')
+    forget_synced_caches()
+    yield tmp_path
+    forget_synced_caches()
+
+
+def forget_synced_caches():
+    for cache in user_cache.SYNCED_CACHES.values():
+        cache.close()
+    user_cache.SYNCED_CACHES.clear()
+
+
+@pytest.fixture
+def org():
+    return SyntheticOrg(users=600, apps=12, groups=12, seed=3)
+
+
+@pytest.fixture
+def fake(org):
+    with FakeOkta(org, limits={}) as server:
+        yield server
+
+
+def run_with_client(fake, work):
+    """Run work(client) on a fresh client and cache state, like a separate run of a script."""
+    forget_synced_caches()
+    with OktaClient(fake.url, 'test') as client:
+        return work(client)
@@ -0,0 +1,45 @@
+import pytest
+from aggregate import count, count_unless, count_where, distinct, group_by, parse_measure, pivot_table, total
+
+COLUMNS = {
+    'dept': ['Sales', 'IT', 'Sales', 'HR', 'IT'],
+    'status': ['ACTIVE', 'ACTIVE', 'SUSPENDED', 'ACTIVE', 'ACTIVE'],
+    'seats': ['1', '2', '', '4', '5'],
+}
+
+
+def test_group_by_one_dimension():
+    measures = {'n': count(), 'active': count_where('status', 'ACTIVE'), 'inactive': count_unless('status', 'ACTIVE'),
+                'seats': total('seats'), 'statuses': distinct('status')}
+    assert group_by(COLUMNS, ['dept'], measures) == [
+        {'dept': 'Sales', 'n': 2, 'active': 1, 'inactive': 1, 'seats': 1, 'statuses': 2},
+        {'dept': 'IT', 'n': 2, 'active': 2, 'inactive': 0, 'seats': 7, 'statuses': 1},
+        {'dept': 'HR', 'n': 1, 'active': 1, 'inactive': 0, 'seats': 4, 'statuses': 1},
+    ]
+
+
+def test_group_by_without_dimensions_is_one_group():
+    assert group_by(COLUMNS, [], {'n': count()}) == [{'n': 5}]
+    assert group_by({'dept': []}, [], {'n': count()}) == []
+
+
+def test_group_by_several_dimensions_matches_a_loop():
+    expected = {}
+    for dept, status in zip(COLUMNS['dept'], COLUMNS['status']):
+        expected[(dept, status)] = expected.get((dept, status), 0) + 1
+    rows = group_by(COLUMNS, ['dept', 'status'], {'n': count()})
+    assert {(row['dept'], row['status']): row['n'] for row in rows} == expected
+
+
+def test_pivot_table_fills_missing_cells_with_zero():
+    assert pivot_table(COLUMNS, ['dept'], ['status'], {'n': count()}) == [
+        {'dept': 'Sales', 'ACTIVE': 1, 'SUSPENDED': 1},
+        {'dept': 'IT', 'ACTIVE': 2, 'SUSPENDED': 0},
+        {'dept': 'HR', 'ACTIVE': 1, 'SUSPENDED': 0},
+    ]
+
+
+def test_parse_measure_rejects_unknown_specs():
+    assert parse_measure('status!=ACTIVE').name == 'count_unless'
+    with pytest.raises(ValueError):
+        parse_measure('median:seats')
@@ -0,0 +1,32 @@
+import os
+from bulk_lifecycle import Journal, plan_steps
+
+
+def test_steps_follow_the_current_status(tmp_path):
+    with Journal(str(tmp_path / "journal.jsonl")) as journal:
+        journal.record('00u1', 'deactivate', True, 204)
+        journal.record('00u2', 'deactivate', True, 204)
+        # Deactivated by this wipe, then reactivated before the run was resumed
+        assert plan_steps({'id': '00u1', 'status': 'ACTIVE'}, journal) == ['deactivate', 'delete']
+        assert plan_steps({'id': '00u2', 'status': 'DEPROVISIONED'}, journal) == ['delete']
+        assert plan_steps({'id': '00u3', 'status': 'DEPROVISIONED'}, journal) == []
+        assert plan_steps({'id': '00u3', 'status': 'SUSPENDED'}, journal) == ['deactivate', 'delete']
+
+
+def test_finished_journal_is_set_aside(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with Journal(path) as journal:
+        journal.record('00u1', 'delete', True, 204)
+        journal.finish()
+    assert not os.path.exists(path)
+    assert len(os.listdir(tmp_path)) == 1
+    assert not Journal(path).done
+
+
+def test_journal_skips_a_half_written_last_line(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    with Journal(path) as journal:
+        journal.record('00u1', 'deactivate', True, 204)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('{"user_id": "00u1", "step": "del')
+    assert Journal(path).done == {'00u1': {'deactivate'}}
@@ -0,0 +1,25 @@
+from checkpoint import Checkpoint
+
+
+def test_resume_loads_finished_steps(state):
+    checkpoint = Checkpoint("report")
+    checkpoint.save("app:1", [1, 2])
+    checkpoint.save("app:2", [])
+    checkpoint.close()
+    with open(checkpoint.path, 'a', encoding='utf-8') as f:
+        f.write('{"key": "app:3", "res')
+
+    resumed = Checkpoint("report", resume=True)
+    assert "app:1" in resumed and resumed.get("app:1") == [1, 2]
+    assert "app:2" in resumed
+    assert "app:3" not in resumed
+    resumed.close()
+
+
+def test_normal_run_starts_over(state):
+    checkpoint = Checkpoint("report")
+    checkpoint.save("app:1", [1])
+    checkpoint.close()
+    fresh = Checkpoint("report")
+    assert "app:1" not in fresh
+    fresh.finish()
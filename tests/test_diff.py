@@ -0,0 +1,30 @@
+from diff import diff_table, merge_join, row_keys
+
+
+def test_merge_join_pairs_rows_by_key():
+    old = {'id': ['b', 'a', 'd']}
+    new = {'id': ['c', 'a', 'b']}
+    old_keys = row_keys(old, ['id'], range(3))
+    new_keys = row_keys(new, ['id'], range(3))
+    pairs = [(old['id'][i] if i is not None else None, new['id'][j] if j is not None else None)
+             for i, j in merge_join(old_keys, new_keys, range(3), range(3))]
+    assert pairs == [('a', 'a'), ('b', 'b'), (None, 'c'), ('d', None)]
+
+
+def test_diff_table_reports_changes_additions_and_removals():
+    old = {'id': ['u1', 'u2', 'u3'], 'profile.department': ['Sales', 'IT', 'HR'], 'lastUpdated': ['1', '1', '1']}
+    new = {'id': ['u3', 'u1', 'u4'], 'profile.department': ['HR', 'Finance', 'IT'], 'lastUpdated': ['2', '2', '2']}
+    changes = list(diff_table('users', old, new))
+    assert changes == [
+        {'table': 'users', 'change': 'changed', 'key': 'u1', 'name': '', 'field': 'profile.department',
+         'old': 'Sales', 'new': 'Finance'},
+        {'table': 'users', 'change': 'removed', 'key': 'u2', 'name': ''},
+        {'table': 'users', 'change': 'added', 'key': 'u4', 'name': ''},
+    ]
+
+
+def test_diff_table_with_compound_keys():
+    old = {'user_id': ['u1', 'u1'], 'app_id': ['a1', 'a2']}
+    new = {'user_id': ['u1', 'u2'], 'app_id': ['a1', 'a2']}
+    changes = [(change['change'], change['key']) for change in diff_table('assignments', old, new)]
+    assert changes == [('removed', 'u1 / a2'), ('added', 'u2 / a2')]
@@ -0,0 +1,9 @@
+from metrics import RunMetrics
+
+
+def test_summary_counts_requests_across_endpoints():
+    metrics = RunMetrics()
+    for url in ("https://example.okta.com/api/v1/users", "https://example.okta.com/api/v1/apps/0oa1/users"):
+        metrics.finish(url, metrics.start(), 200, 10)
+    assert metrics.total_requests() == 2
+    assert "2 requests" in metrics.summary().splitlines()[0]
@@ -0,0 +1,76 @@
+import time
+from rate_governor import DEFAULT_LIMITS, RateGovernor, TokenBucket, bucket_for, retry_after
+
+
+class Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_bucket_for_keeps_nested_endpoints_apart():
+    assert bucket_for("https://example.okta.com/api/v1/users/00u1/factors") == '/api/v1/users/*/factors'
+    assert bucket_for("/api/v1/apps/0oa1/users?limit=500") == '/api/v1/apps/*/users'
+    assert bucket_for("/api/v1/users?search=x") == '/api/v1/users'
+    assert bucket_for("/api/v1/groups/00g1/users") == '/api/v1/groups'
+
+
+def test_first_request_goes_out_at_once():
+    bucket = TokenBucket()
+    now = time.time()
+    assert bucket.reserve(now) == now
+
+
+def test_requests_are_spread_over_the_window():
+    bucket = TokenBucket(headroom=1)
+    now = 1000.0
+    bucket.reserve(now)
+    bucket.update({'x-rate-limit-limit': '11', 'x-rate-limit-remaining': '10', 'x-rate-limit-reset': '1010'})
+    bucket.release()
+    slots = [bucket.reserve(now) for _ in range(9)]
+    gaps = [later - earlier for earlier, later in zip(slots, slots[1:])]
+    assert slots[0] == now
+    assert all(gap > 0 for gap in gaps)
+    assert slots[-1] < 1010
+
+
+def test_exhausted_bucket_waits_for_the_reset():
+    bucket = TokenBucket(headroom=1)
+    now = 1000.0
+    bucket.reserve(now)
+    bucket.update({'x-rate-limit-limit': '5', 'x-rate-limit-remaining': '1', 'x-rate-limit-reset': '1030'})
+    bucket.release()
+    assert bucket.reserve(now) >= 1031
+
+
+def test_governor_sleeps_for_the_reserved_slot():
+    slept = []
+    governor = RateGovernor(sleep=slept.append)
+    url = "/api/v1/users"
+    governor.acquire(url)
+    reset = int(time.time()) + 30
+    governor.update(url, Response({'x-rate-limit-limit': '5', 'x-rate-limit-remaining': '1',
+                                   'x-rate-limit-reset': str(reset)}))
+    governor.release(url)
+    governor.acquire(url)
+    assert slept and slept[0] > 25
+
+
+def test_limit_uses_the_reported_limit_then_the_default():
+    governor = RateGovernor()
+    assert governor.limit("https://example.okta.com/api/v1/apps/0oa1/users") == DEFAULT_LIMITS['/api/v1/apps/*/users']
+    governor.update("https://example.okta.com/api/v1/apps",
+                    Response({'x-rate-limit-limit': '50', 'x-rate-limit-remaining': '49', 'x-rate-limit-reset': '2000'}))
+    assert governor.limit("https://example.okta.com/api/v1/apps?filter=x") == 50
+
+
+def test_retry_after_accepts_fractions_and_ignores_garbage():
+    def throttled(value):
+        response = Response({'Retry-After': value})
+        response.status_code = 503
+        return response
+
+    assert retry_after(throttled("1.5")) == 1.5
+    assert retry_after(throttled("120")) == 120
+    assert retry_after(throttled("Wed, 21 Oct 2015 07:28:00 GMT")) == 0
+    for value in ("soon", "nan", "inf", "Wed, 99 Foo 2015"):
+        assert retry_after(throttled(value)) is None
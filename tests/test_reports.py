@@ -0,0 +1,298 @@
+"""End to end runs against fake_okta.
+
+Runs through the user cache are compared with OKTA_USER_CACHE=off, which
+reads the plain /users listing the scripts were first written against.
+"""
+import csv
+import io
+import contextlib
+import gzip
+import json
+import os
+from datetime import datetime, timedelta, timezone
+import pytest
+import requests
+from checkpoint import Checkpoint
+from factor_inventory import FactorInventory
+from benchmark import load_cli
+from conftest import run_with_client
+from fake_okta import timestamp
+
+cli = load_cli()
+fastpass = cli.load_script('fastpass')
+enrich = cli.load_script('enrich')
+app_report = cli.load_script('app-report')
+wipe = cli.load_script('wipe')
+
+
+def read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def a_moment_ago():
+    # The System Log is read up to the moment a run starts, exclusive
+    return datetime.now(timezone.utc) - timedelta(seconds=1)
+
+
+def uncached(monkeypatch, fake, work):
+    with monkeypatch.context() as patch:
+        patch.setenv('OKTA_USER_CACHE', 'off')
+        patch.setenv('OKTA_FACTOR_CACHE', 'off')
+        return run_with_client(fake, work)
+
+
+def write_enrich_input(org, path):
+    """Rows by email, by name only, by misspelled name, and unknown people."""
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['First', 'Last', 'Email'])
+        for i, user in enumerate(org.users[::3]):
+            profile = user['profile']
+            if i % 4 == 0:
+                writer.writerow([profile['firstName'], profile['lastName'], ''])
+            elif i % 4 == 1:
+                writer.writerow([profile['firstName'][:1], profile['lastName'][:-1], ''])
+            elif i % 4 == 2:
+                writer.writerow(['Unknown', f"Person{i}", f"unknown{i}@elsewhere.com"])
+            else:
+                writer.writerow([profile['firstName'], profile['lastName'], profile['email']])
+
+
+def test_fastpass_matches_uncached_run_after_incremental_sync(state, org, fake, monkeypatch):
+    output = str(state / "fastpass.csv")
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    first = read(output)
+
+    # An updated user must keep its place in the report
+    user = org.users[3]
+    user['lastUpdated'] = timestamp(datetime.now(timezone.utc))
+    user['profile']['userType'] = 'Full Time'
+    user['status'] = 'ACTIVE'
+    org.searches.clear()
+    org.enroll_fastpass(org.users[5]['id'], when=a_moment_ago())
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    incremental = read(output)
+
+    uncached(monkeypatch, fake, lambda client: fastpass.write_report(client, output))
+    assert incremental == read(output)
+    assert incremental != first
+
+
+def test_fastpass_resume_skips_finished_lookups(state, org, fake, monkeypatch):
+    output = str(state / "fastpass.csv")
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    expected = read(output)
+
+    # A run that dies halfway leaves its finished rows in the checkpoint
+    def interrupted(client):
+        checkpoint = Checkpoint("fastpass")
+        rows = fastpass.iter_user_report(client, checkpoint=checkpoint)
+        for _ in range(100):
+            next(rows)
+        rows.close()
+        checkpoint.close()
+    monkeypatch.setenv('OKTA_FACTOR_CACHE', 'off')
+    run_with_client(fake, interrupted)
+    fake.reset_counters()
+    run_with_client(fake, lambda client: fastpass.write_report(client, output, resume=True))
+    assert read(output) == expected
+    qualifying = sum(1 for _ in csv.DictReader(io.StringIO(expected)))
+    assert fake.counts['/api/v1/users/*/factors'] <= qualifying - 100
+
+
+def test_factor_inventory_picks_up_logged_changes(state, org, fake, monkeypatch):
+    output = str(state / "fastpass.csv")
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    user = next(user for user in org.users
+                if user['status'] == 'ACTIVE' and user['profile']['userType'] in fastpass.VALID_USER_TYPES)
+    org.enroll_fastpass(user['id'], 'IOS', a_moment_ago())
+    fake.reset_counters()
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    incremental = read(output)
+    assert fake.counts.get('/api/v1/users/*/factors', 0) < 10
+
+    uncached(monkeypatch, fake, lambda client: fastpass.write_report(client, output))
+    assert incremental == read(output)
+
+
+def test_enrich_matches_uncached_run(state, org, fake, monkeypatch):
+    source, output = str(state / "input.csv"), str(state / "enriched.csv")
+    write_enrich_input(org, source)
+    for fuzzy in (False, True):
+        run_with_client(fake, lambda client: enrich.enrich_file(client, source, output, fuzzy))
+        cached = read(output)
+        uncached(monkeypatch, fake, lambda client: enrich.enrich_file(client, source, output, fuzzy))
+        assert cached == read(output)
+    assert 'DEPROVISIONED' not in cached
+
+
+def test_app_report_strategies_match_uncached_run(state, fake, monkeypatch):
+    location = str(state / "apps")
+    outputs = []
+    for strategy in ('apps', 'users'):
+        run_with_client(fake, lambda client: app_report.build_report(client, location, ('csv', 'long'), strategy))
+        outputs.append((read(location + ".csv"), read(location + "-long.csv")))
+    uncached(monkeypatch, fake, lambda client: app_report.build_report(client, location, ('csv', 'long'), 'apps'))
+    outputs.append((read(location + ".csv"), read(location + "-long.csv")))
+    assert outputs[0] == outputs[1] == outputs[2]
+
+
+def test_wipe_leaves_already_deprovisioned_users_alone(state, org, fake):
+    journal = str(state / "journal.jsonl")
+    deprovisioned = {user['id'] for user in org.users if user['status'] == 'DEPROVISIONED'}
+    expected = {user['id'] for user in org.users
+                if user['status'] != 'DEPROVISIONED' and user['profile']['department'] != 'IT'}
+    assert deprovisioned
+
+    plan = io.StringIO()
+    with contextlib.redirect_stdout(plan):
+        run_with_client(fake, lambda client: wipe.delete_users(client, dry_run=True, journal_path=journal))
+    planned = {line.split(':')[0] for line in plan.getvalue().splitlines() if line.endswith(('deactivate, delete', ': delete'))}
+    assert planned == {org.users_by_id[user_id]['profile']['login'] for user_id in expected}
+
+    # Deactivate a few by hand as an interrupted run would, then let a real run finish
+    from bulk_lifecycle import Journal
+    with Journal(journal) as entries:
+        for user_id in sorted(expected)[:5]:
+            fake.org.users_by_id[user_id]['status'] = 'DEPROVISIONED'
+            entries.record(user_id, 'deactivate', True, 204)
+    org.searches.clear()
+    # One of them was reactivated since; its journaled deactivate no longer holds
+    reactivated = sorted(expected)[0]
+    fake.org.users_by_id[reactivated]['status'] = 'ACTIVE'
+    org.searches.clear()
+    run_with_client(fake, lambda client: wipe.delete_users(client, journal_path=journal, confirmed=True))
+    remaining = {user['id'] for user in org.users}
+    assert not expected & remaining
+    assert deprovisioned <= remaining
+    assert not os.path.exists(journal)
+
+
+def test_snapshot_diff_reports_org_changes(state, org, fake):
+    def snapshot(name):
+        args = cli.build_parser().parse_args(['snapshot', '--output', str(state / name)])
+        args.workers = 4
+        return run_with_client(fake, lambda client: args.run(client, args))
+
+    assert snapshot("before")
+    user = next(user for user in org.users if user['status'] == 'ACTIVE')
+    user['profile']['department'] = 'Finance' if user['profile']['department'] != 'Finance' else 'Legal'
+    user['lastUpdated'] = timestamp(datetime.now(timezone.utc) + timedelta(seconds=1))
+    org.searches.clear()
+    org.enroll_fastpass(user['id'], when=a_moment_ago())
+    assert snapshot("after")
+
+    report = str(state / "changes.csv")
+    args = cli.build_parser().parse_args(['diff', str(state / "before"), str(state / "after"), '--output', report])
+    args.run(None, args)
+    changes = list(csv.DictReader(open(report, encoding='utf-8')))
+    assert {(change['table'], change['change'], change['key'].split(' / ')[0]) for change in changes} == {
+        ('users', 'changed', user['id']), ('factors', 'added', user['id'])}
+    with gzip.open(state / "after" / "users.json.gz", 'rt') as f:
+        assert user['id'] in json.load(f)['id']
+
+
+def failing_after(monkeypatch, position):
+    """Make user listings fail with a 403 from the given cursor on."""
+    from fake_okta import FakeOktaHandler
+    page = FakeOktaHandler.page
+
+    def failing(self, path, query, items, collection):
+        if collection == '/api/v1/users' and int(query.get('after', 0)) >= position:
+            return 403, {'errorSummary': 'You do not have permission to perform the requested action'}, {}
+        return page(self, path, query, items, collection)
+    monkeypatch.setattr(FakeOktaHandler, 'page', failing)
+
+
+def test_enrich_refuses_a_partial_user_sync(state, org, fake, monkeypatch):
+    source, output = str(state / "input.csv"), str(state / "enriched.csv")
+    write_enrich_input(org, source)
+    with monkeypatch.context() as patch:
+        failing_after(patch, 400)
+        with pytest.raises(requests.exceptions.HTTPError):
+            run_with_client(fake, lambda client: enrich.enrich_file(client, source, output))
+
+    # A failed full sync leaves the last finished one in place
+    run_with_client(fake, lambda client: enrich.enrich_file(client, source, output))
+    expected = read(output)
+    with monkeypatch.context() as patch:
+        failing_after(patch, 400)
+        patch.setenv('OKTA_FULL_SYNC', '1')
+        assert run_with_client(fake, lambda client: enrich.enrich_file(client, source, output))
+    assert read(output) == expected
+
+
+def test_snapshot_assignments_keep_apps_that_share_a_label(state, org, fake):
+    org.apps[2]['label'] = org.apps[1]['label']
+    report_users = {user['id'] for user in org.users
+                    if user['status'] == 'ACTIVE' and user['profile']['userType'] in app_report.VALID_USER_TYPES}
+    expected = {(user_id, app['id']) for app in org.apps if app['status'] == 'ACTIVE'
+                for user_id in org.app_users[app['id']] if user_id in report_users}
+    for strategy in ('apps', 'users'):
+        directory = state / strategy
+        args = cli.build_parser().parse_args(['snapshot', '--output', str(directory), '--tables', 'assignments',
+                                              '--strategy', strategy])
+        args.workers = 4
+        assert run_with_client(fake, lambda client: args.run(client, args))
+        with gzip.open(directory / "assignments.json.gz", 'rt') as f:
+            table = json.load(f)
+        assert set(zip(table['user_id'], table['app_id'])) == expected
+        assert len(table['user_id']) == len(expected)
+
+
+def test_snapshot_users_match_uncached_run(state, fake, monkeypatch):
+    def users(name):
+        args = cli.build_parser().parse_args(['snapshot', '--output', str(state / name), '--tables', 'users'])
+        args.workers = 4
+        assert run_with_client(fake, lambda client: args.run(client, args))
+        with gzip.open(state / name / "users.json.gz", 'rt') as f:
+            return json.load(f)
+
+    cached = users("cached")
+    with monkeypatch.context() as patch:
+        patch.setenv('OKTA_USER_CACHE', 'off')
+        assert users("uncached") == cached
+    assert 'DEPROVISIONED' not in cached['status']
+
+
+def test_app_report_weighs_requests_by_their_rate_limit():
+    # Many apps: the users side sends fewer requests, but to a bucket with a fifth of the limit
+    assert app_report.choose_strategy(600, 400, limits={'apps': 500, 'users': 100}) == 'apps'
+    assert app_report.choose_strategy(600, 400, limits={'apps': 100, 'users': 100}) == 'users'
+    assert app_report.choose_strategy(50, 5000, limits={'apps': 500, 'users': 100}) == 'apps'
+
+
+def interrupt_fastpass(client, rows_done=100):
+    """A fastpass run that dies after rows_done rows, leaving its checkpoint and inventory behind."""
+    inventory = fastpass.open_inventory(client, 'fastpass')
+    checkpoint = Checkpoint("fastpass")
+    rows = fastpass.iter_user_report(client, checkpoint=checkpoint, inventory=inventory)
+    done = [next(rows) for _ in range(rows_done)]
+    rows.close()
+    checkpoint.close()
+    inventory.close()
+    return done
+
+
+def test_fastpass_resume_refetches_users_with_logged_changes(state, org, fake, monkeypatch):
+    output = str(state / "fastpass.csv")
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    done = run_with_client(fake, interrupt_fastpass)
+
+    user = org.users_by_id[next(user['id'] for user in org.users if user['profile']['login'] == done[10]['login'])]
+    org.enroll_fastpass(user['id'], 'IOS', a_moment_ago())
+    run_with_client(fake, lambda client: fastpass.write_report(client, output, resume=True))
+    resumed = read(output)
+    uncached(monkeypatch, fake, lambda client: fastpass.write_report(client, output))
+    assert resumed == read(output)
+
+
+def test_fastpass_resume_without_the_log_keeps_the_watermark(state, org, fake):
+    output = str(state / "fastpass.csv")
+    run_with_client(fake, interrupt_fastpass)
+    run_with_client(fake, lambda client: fastpass.write_report(client, output, resume=True))
+    inventory = FactorInventory(scope='fastpass')
+    assert inventory.get_meta(inventory.watermark_key) is None
+    run_with_client(fake, lambda client: fastpass.write_report(client, output))
+    assert inventory.get_meta(inventory.watermark_key) is not None
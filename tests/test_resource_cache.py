@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from resource_cache import ResourceCache, resource_key, settle
+
+
+def fetch_through(cache, key, fetch, keep=False):
+    future, new = cache.claim(key, keep)
+    if new:
+        settle(future, fetch)
+    return future.result()
+
+
+def test_overlapping_fetches_share_one_request():
+    cache = ResourceCache(ttl=0)
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return [1, 2]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(fetch_through, cache, 'users', slow)
+        started.wait(5)
+        others = [executor.submit(fetch_through, cache, 'users', slow) for _ in range(3)]
+        release.set()
+        results = [first.result()] + [other.result() for other in others]
+    assert calls == [1]
+    assert all(result == [1, 2] for result in results)
+
+
+def test_only_kept_collections_outlive_their_fetch():
+    now = [0.0]
+    cache = ResourceCache(ttl=60, clock=lambda: now[0])
+    fetch_through(cache, 'apps', lambda: ['app'], keep=True)
+    fetch_through(cache, 'factors', lambda: ['factor'])
+    assert cache.claim('apps', True)[1] is False
+    assert 'factors' not in cache.entries
+    now[0] = 61
+    assert cache.claim('apps', True)[1] is True
+
+
+def test_failed_fetches_are_not_kept():
+    cache = ResourceCache(ttl=60)
+    future, _ = cache.claim('apps', True)
+
+    def fail():
+        raise RuntimeError("boom")
+    settle(future, fail)
+    assert cache.claim('apps', True)[1] is True
+
+
+def test_clear_during_a_fetch_leaves_nothing_behind():
+    cache = ResourceCache(ttl=60)
+    future, _ = cache.claim('apps', True)
+    cache.clear()
+    settle(future, lambda: ['app'])
+    assert cache.entries == {} and cache.expires == {}
+
+
+def test_key_ignores_parameter_order():
+    assert resource_key("u", {'a': 1, 'b': 2}) == resource_key("u", {'b': 2, 'a': 1})
@@ -0,0 +1,21 @@
+from datetime import timedelta
+from conftest import run_with_client
+from fake_okta import timestamp
+from factor_inventory import parse_timestamp
+import user_cache
+
+
+def test_incremental_sync_rereads_users_updated_just_before_the_watermark(state, org, fake):
+    watermark = run_with_client(fake, lambda client: user_cache.synced_cache(client).watermark)
+
+    # An update that only showed up in search after the last sync had run
+    user = next(user for user in org.users if user['status'] == 'ACTIVE')
+    user['profile']['department'] = 'Late Department'
+    user['lastUpdated'] = timestamp(parse_timestamp(watermark) - timedelta(seconds=30))
+    org.searches.clear()
+
+    cache = run_with_client(fake, user_cache.synced_cache)
+    stored = {stored['id']: stored for stored in cache.iter_users()}
+    assert stored[user['id']]['profile']['department'] == 'Late Department'
+    assert cache.watermark == watermark
+    assert cache.count() == len(org.users)
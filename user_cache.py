@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""On-disk copy of the org's users, kept current with lastUpdated syncs.
+
+The first sync downloads every user. Later syncs only ask Okta for users
+whose lastUpdated is newer than the newest one already stored, less a
+few minutes for search results that lag behind, and upsert them, so a
+script that runs several times a day reads the org from disk in
+milliseconds instead of crawling /api/v1/users again. Each user's match
+keys (emails, login and names, see match_index) are stored with it
+so lookups need no index to be rebuilt at startup.
+
+Users that are hard deleted in Okta never show up in an incremental
+sync; pass full=True now and then to rebuild the store from scratch. A
+full sync fills staging tables and only replaces the stored users once
+every page is in, so the previous sync stays readable if it fails.
+"""
+import json
+import os
+import re
+import sqlite3
+from datetime import timedelta
+from factor_inventory import parse_timestamp, timestamp
+from match_index import index_keys
+from user_query import OMIT_CREDENTIALS, UserQuery
+
+
+DEFAULT_CACHE_PATH = os.path.expanduser("~/.okta-scripts/users.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    status TEXT,
+    last_updated TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_status ON users (status);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS match_keys (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    user_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS match_keys_lookup ON match_keys (kind, key);
+CREATE INDEX IF NOT EXISTS match_keys_user ON match_keys (user_id);
+CREATE TABLE IF NOT EXISTS users_staging (
+    id TEXT PRIMARY KEY,
+    status TEXT,
+    last_updated TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS match_keys_staging (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    user_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS match_keys_staging_user ON match_keys_staging (user_id);
+"""
+
+# Bump when match_index.index_keys changes so stored keys get rebuilt
+MATCH_KEYS_VERSION = '2'
+# Bump when stores written by older versions need a full sync; 2 keeps rows in listing order
+STORE_VERSION = '2'
+# Search results can lag behind updates, so each sync re-reads this much before the watermark
+SYNC_OVERLAP = timedelta(minutes=5)
+
+
+def cache_path():
+    """Location of the user store, overridable with OKTA_USER_CACHE."""
+    return os.getenv('OKTA_USER_CACHE', DEFAULT_CACHE_PATH)
+
+
+class UserCache:
+    """SQLite user store for one org."""
+
+    def __init__(self, path=None):
+        self.path = path or cache_path()
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+        if self.get_meta('match_keys_version') != MATCH_KEYS_VERSION:
+            self.rebuild_match_keys()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key, default=None):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def watermark(self):
+        """Newest lastUpdated stored so far, or None before the first sync."""
+        return self.get_meta('watermark')
+
+    def is_complete(self, org_url):
+        """True when the store holds a finished sync of org_url, even if a later one failed."""
+        return self.watermark is not None and self.get_meta('org_url') == org_url
+
+    def upsert(self, users, staged=False):
+        """Insert or update a batch of Okta user objects and their match keys.
+
+        Updated users keep their row, so reads stay in the order Okta first
+        listed them. staged=True writes to the tables of a full sync in progress.
+        """
+        suffix = '_staging' if staged else ''
+        self.db.executemany(
+            f"INSERT INTO users{suffix} (id, status, last_updated, data) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (id) DO UPDATE SET status = excluded.status,"
+            " last_updated = excluded.last_updated, data = excluded.data",
+            [(user['id'], user.get('status'), user.get('lastUpdated'), json.dumps(user)) for user in users]
+        )
+        self.db.executemany(f"DELETE FROM match_keys{suffix} WHERE user_id = ?", [(user['id'],) for user in users])
+        self.db.executemany(
+            f"INSERT INTO match_keys{suffix} (kind, key, user_id) VALUES (?, ?, ?)",
+            [(kind, key, user['id']) for user in users for kind, key in index_keys(user)]
+        )
+
+    def replace_with_staged(self):
+        """Swap the staged users of a finished full sync in for the stored ones."""
+        self.db.execute("DELETE FROM users")
+        self.db.execute("DELETE FROM match_keys")
+        self.db.execute("INSERT INTO users (id, status, last_updated, data)"
+                        " SELECT id, status, last_updated, data FROM users_staging ORDER BY rowid")
+        self.db.execute("INSERT INTO match_keys (kind, key, user_id) SELECT kind, key, user_id FROM match_keys_staging")
+        self.db.execute("DELETE FROM users_staging")
+        self.db.execute("DELETE FROM match_keys_staging")
+
+    def rebuild_match_keys(self):
+        """Recompute every stored user's match keys, staged ones included."""
+        with self.db:
+            for suffix in ('', '_staging'):
+                self.db.execute(f"DELETE FROM match_keys{suffix}")
+                rows = self.db.execute(f"SELECT id, data FROM users{suffix}").fetchall()
+                self.db.executemany(
+                    f"INSERT INTO match_keys{suffix} (kind, key, user_id) VALUES (?, ?, ?)",
+                    ((kind, key, user_id) for user_id, data in rows for kind, key in index_keys(json.loads(data)))
+                )
+            self.set_meta('match_keys_version', MATCH_KEYS_VERSION)
+
+    def lookup(self, kind, key, query=None):
+        """Users stored under a match key that match query, in cache order."""
+        query = query or UserQuery()
+        clauses, args = filters(query)
+        where = "".join(f" AND {clause}" for clause in clauses)
+        rows = self.db.execute(
+            "SELECT users.data FROM match_keys JOIN users ON users.id = match_keys.user_id"
+            f" WHERE match_keys.kind = ? AND match_keys.key = ?{where} ORDER BY users.rowid",
+            (kind, key, *args)
+        )
+        return [query.project(json.loads(data)) for (data,) in rows]
+
+    def sync(self, client, full=False):
+        """Bring the store up to date and return the number of users written.
+
+        The position of the crawl is committed together with each page, so
+        a sync that fails partway continues from the next page on the
+        following run instead of starting over.
+        """
+        state = json.loads(self.get_meta('sync_state') or 'null')
+        if state and (full or state.get('org_url', client.org_url) != client.org_url):
+            state = None
+        if state:
+            print(f"Resuming interrupted user sync at query {state['query'] + 1} of {len(state['queries'])}...")
+        else:
+            if self.get_meta('org_url') not in (None, client.org_url):
+                print("User cache belongs to a different org; starting over")
+                full = True
+            elif self.watermark and self.get_meta('store_version') != STORE_VERSION:
+                print("User cache was written by an older version; starting over")
+                full = True
+            watermark = None if full else self.watermark
+            if watermark:
+                print(f"Syncing users updated since {watermark}...")
+                since = timestamp(parse_timestamp(watermark) - SYNC_OVERLAP)
+                search = f'lastUpdated ge "{since}"'
+            else:
+                print("Running full user sync...")
+                search = None
+            # Plain listings leave out DEPROVISIONED users, so ask for them separately
+            queries = [search, f'{search} and status eq "DEPROVISIONED"' if search else 'status eq "DEPROVISIONED"']
+            state = {'queries': queries, 'query': 0, 'next_url': None, 'newest': watermark,
+                     'org_url': client.org_url, 'full': not watermark}
+            with self.db:
+                if state['full']:
+                    self.db.execute("DELETE FROM users_staging")
+                    self.db.execute("DELETE FROM match_keys_staging")
+                self.set_meta('sync_state', json.dumps(state))
+
+        written = 0
+        while state['query'] < len(state['queries']):
+            url, params = state['next_url'], None
+            if not url:
+                url, params = "/api/v1/users", {'limit': 200}
+                query = state['queries'][state['query']]
+                if query:
+                    params['search'] = query
+            for page, next_url in client.iter_pages_with_cursor(url, params=params, headers=OMIT_CREDENTIALS):
+                for user in page:
+                    last_updated = user.get('lastUpdated')
+                    if last_updated and (state['newest'] is None or last_updated > state['newest']):
+                        state['newest'] = last_updated
+                state['next_url'] = next_url
+                if not next_url:
+                    state['query'] += 1
+                with self.db:
+                    self.upsert(page, staged=state.get('full', False))
+                    self.set_meta('sync_state', json.dumps(state))
+                written += len(page)
+
+        # Only move the watermark, or replace the store, once every page is stored
+        with self.db:
+            if state.get('full'):
+                self.replace_with_staged()
+                self.set_meta('org_url', client.org_url)
+                self.set_meta('store_version', STORE_VERSION)
+                self.db.execute("DELETE FROM meta WHERE key = 'watermark'")
+            if state['newest']:
+                self.set_meta('watermark', state['newest'])
+            self.db.execute("DELETE FROM meta WHERE key = 'sync_state'")
+        print(f"User cache synced ({written} users written, {self.count()} stored)")
+        return written
+
+    def remove(self, user_ids):
+        """Drop users that were deleted in Okta; syncs never report those."""
+        with self.db:
+            self.db.executemany("DELETE FROM users WHERE id = ?", [(user_id,) for user_id in user_ids])
+            self.db.executemany("DELETE FROM match_keys WHERE user_id = ?", [(user_id,) for user_id in user_ids])
+
+    def count(self, status=None):
+        if status:
+            return self.db.execute("SELECT COUNT(*) FROM users WHERE status = ?", (status,)).fetchone()[0]
+        return self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def iter_users(self, query=None):
+        """Yield stored users matching query, filtered inside SQLite."""
+        query = query or UserQuery()
+        where, args = where_clause(query)
+        for (data,) in self.db.execute(f"SELECT data FROM users{where} ORDER BY rowid", args):
+            yield query.project(json.loads(data))
+
+    def columns(self, attributes, query=None):
+        """Stored users matching query as one list of values per dotted attribute (see aggregate)."""
+        where, args = where_clause(query or UserQuery())
+        selected = ", ".join(column_for(attribute) for attribute in attributes)
+        rows = self.db.execute(f"SELECT {selected} FROM users{where} ORDER BY rowid", args).fetchall()
+        return {attribute: [row[i] for row in rows] for i, attribute in enumerate(attributes)}
+
+    def count_by(self, attribute, query=None):
+        """Count stored users matching query per lowercased value of attribute."""
+        where, args = where_clause(query or UserQuery())
+        column = column_for(attribute)
+        sql = f"SELECT lower({column}), COUNT(*) FROM users{where} GROUP BY lower({column})"
+        return dict(self.db.execute(sql, args).fetchall())
+
+
+def column_for(attribute):
+    """SQL expression reading a dotted user attribute from the users table."""
+    if not re.fullmatch(r'[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*', attribute):
+        raise ValueError(f"Not a user attribute: {attribute!r}")
+    return 'status' if attribute == 'status' else f"json_extract(data, '$.{attribute}')"
+
+
+def filters(query):
+    """SQL conditions on the users table, and their arguments, that apply a UserQuery."""
+    clauses = []
+    args = []
+    for attribute, values in query.conditions():
+        clauses.append(f"{column_for(attribute)} IN ({', '.join('?' * len(values))})")
+        args.extend(values)
+    if query.exclude_statuses:
+        clauses.append(f"status NOT IN ({', '.join('?' * len(query.exclude_statuses))})")
+        args.extend(query.exclude_statuses)
+    return clauses, args
+
+
+def where_clause(query):
+    """WHERE clause and arguments that apply a UserQuery inside SQLite."""
+    clauses, args = filters(query)
+    if not clauses:
+        return "", args
+    return " WHERE " + " AND ".join(clauses), args
+
+
+# Caches already synced in this process, by (org URL, cache path)
+SYNCED_CACHES = {}
+
+
+def synced_cache(client, path=None, full=False):
+    """Open the user store and sync it, once per process.
+
+    Later calls for the same org and path return the same open store
+    without syncing again, so reports run together from a job file share
+    one crawl. The store stays open until the process exits. Set
+    OKTA_FULL_SYNC=1 to force a full rebuild on the first sync.
+    """
+    path = path or cache_path()
+    key = (client.org_url, path)
+    if key not in SYNCED_CACHES:
+        cache = UserCache(path)
+        cache.sync(client, full=full or os.getenv('OKTA_FULL_SYNC') == '1')
+        SYNCED_CACHES[key] = cache
+    return SYNCED_CACHES[key]
+
+
+def iter_org_users(client, query=None, path=None, full=False):
+    """Yield the org's users that match query.
+
+    Users come from the local store after an incremental sync. Set
+    OKTA_USER_CACHE=off to skip it and search Okta directly.
+    """
+    if (path or cache_path()) == 'off':
+        yield from client.iter_users(query)
+        return
+    yield from synced_cache(client, path, full).iter_users(query)
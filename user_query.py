@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Declarative description of which users, and which attributes, a report needs.
+
+A UserQuery is turned into an Okta search= expression so filtering happens
+on Okta's side, into a WHERE clause for the local user cache, and into a
+projection that drops every profile attribute the report does not read.
+"""
+
+
+# Asks Okta to leave credentials and their links out of user objects
+OMIT_CREDENTIALS = {'Content-Type': 'application/json; okta-response=omitCredentials,omitCredentialsLinks'}
+
+# Query fields and where they live on a user object
+SEARCH_FIELDS = {
+    'statuses': 'status',
+    'user_types': 'profile.userType',
+    'departments': 'profile.department',
+}
+
+
+def quote(value):
+    """Quote a value for use in an Okta search expression."""
+    escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def lookup(user, attribute):
+    """Read a dotted attribute such as profile.userType from a user object."""
+    value = user
+    for key in attribute.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+class UserQuery:
+    """Users a report needs, expressed once and applied wherever users are read."""
+
+    def __init__(self, statuses=None, user_types=None, departments=None,
+                 exclude_statuses=None, fields=None):
+        self.statuses = list(statuses or [])
+        self.user_types = list(user_types or [])
+        self.departments = list(departments or [])
+        self.exclude_statuses = list(exclude_statuses or [])
+        self.fields = tuple(fields) if fields else None
+
+    def conditions(self):
+        """(attribute, values) pairs that a matching user must satisfy."""
+        for name, attribute in SEARCH_FIELDS.items():
+            values = getattr(self, name)
+            if values:
+                yield attribute, values
+
+    def search(self):
+        """Okta search= expression for this query, or None to list everyone."""
+        clauses = []
+        for attribute, values in self.conditions():
+            clause = ' or '.join(f'{attribute} eq {quote(value)}' for value in values)
+            clauses.append(f'({clause})' if len(values) > 1 else clause)
+        return ' and '.join(clauses) or None
+
+    def params(self):
+        params = {'limit': 200}
+        search = self.search()
+        if search:
+            params['search'] = search
+        return params
+
+    def matches(self, user):
+        """Apply the query locally.
+
+        Okta's search treats DEPROVISIONED users differently from plain
+        listings, so results are always checked here as well.
+        """
+        if user.get('status') in self.exclude_statuses:
+            return False
+        return all(lookup(user, attribute) in values for attribute, values in self.conditions())
+
+    def project(self, user):
+        """Trim a user object down to the profile attributes the report reads."""
+        if self.fields is None:
+            return user
+        profile = user.get('profile', {})
+        return {
+            'id': user.get('id'),
+            'status': user.get('status'),
+            'lastUpdated': user.get('lastUpdated'),
+            'profile': {key: profile[key] for key in self.fields if key in profile}
+        }